@@ -1,7 +1,19 @@
 #!/usr/bin/env python3
 
+import re
 import sys
+import itertools
+import json
+import hashlib
+import threading
+import time
+import struct
 import argparse
+from array import array
+from bisect import bisect_right
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 
 KEYWORD_ONCE = 'once'
 KEYWORD_START = 'start'
@@ -27,12 +39,52 @@ class A2BParseException(Exception):
 
 class A2BExecutionException(Exception):
     def __init__(self, description):
+        self.description = description
         self.message = '[Runtime Error]: %s' % (description)
         super().__init__(self.message)
 
 class Program(object):
     def __init__(self, exprs):
-        self.exprs = list(exprs)
+        self.exprs = tuple(exprs)
+        self.compiled = {}
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state['compiled'] = {}
+        return state
+
+    def compile(self, key, build):
+        # Engines keep their per-program tables here so that repeated
+        # executions of one parsed program only pay the build cost once.
+        artifact = self.compiled.get(key)
+        if artifact is None:
+            # Builds are deterministic, so a thread that loses the race
+            # simply adopts the artifact stored first.
+            artifact = self.compiled.setdefault(key, build(self))
+        return artifact
+
+class ExecutionContext(object):
+    # Everything a run changes lives here rather than on the parsed Program,
+    # so one program can be executed by several threads at once.  Bit i of
+    # `once` is set after (once) rule i has fired.  With a `max_work` budget
+    # each step is charged the characters it scans (the string it starts
+    # from) plus those it copies (the string it produces); `deadline` is a
+    # time.perf_counter() value.
+    def __init__(self, max_steps=None, max_length=None, max_work=None, deadline=None):
+        self.max_steps = max_steps
+        self.max_length = max_length
+        self.max_work = max_work
+        self.deadline = deadline
+        self.once = 0
+        self.steps = 0
+        self.work = 0
+        self.peak_length = 0
+
+    def spent(self, index):
+        return self.once >> index & 1
+
+    def spend(self, index):
+        self.once |= 1 << index
 
 class Expression(object):
     def __init__(self, line_no, plain_text, left, right):
@@ -40,14 +92,20 @@ class Expression(object):
         self.plain_text = plain_text
         self.left = left
         self.right = right
-        self.executed = 0
 
-    def Execute(self, input_data):
-        if self.left.keyword == KEYWORD_ONCE and self.executed:
+    def Execute(self, input_data, context=None, index=0):
+        # The rule holds no run state of its own: a (once) rule needs the
+        # ExecutionContext of the run and its `index` in the program to know
+        # whether it has already fired.
+        once = self.left.keyword == KEYWORD_ONCE
+        if once and context is None:
+            raise ValueError('A (once) rule needs the ExecutionContext of its run')
+        if once and context.spent(index):
             return EXECUTED_PASS, ''
         if not self.left.match(input_data):
             return EXECUTED_PASS, ''
-        self.executed += 1
+        if once:
+            context.spend(index)
         result = self.left.replace(input_data, self.right)
         if self.right.keyword == KEYWORD_RETURN:
             return EXECUTED_RETURN, result
@@ -80,21 +138,23 @@ class Pattern(object):
     def replace(self, input_data, other):
         assert self.match(input_data)
         start, end = self.match_span(input_data)
+        return other.rewrite(input_data, start, end)
 
-        if other.keyword == KEYWORD_RETURN:
-            return other.pattern
+    def rewrite(self, input_data, start, end):
+        if self.keyword == KEYWORD_RETURN:
+            return self.pattern
 
         before = input_data[:start]
         after = input_data[end:]
-        if other.keyword == KEYWORD_START:
-            return other.pattern + before + after
-        if other.keyword == KEYWORD_END:
-            return before + after + other.pattern
-        return before + other.pattern + after
+        if self.keyword == KEYWORD_START:
+            return self.pattern + before + after
+        if self.keyword == KEYWORD_END:
+            return before + after + self.pattern
+        return before + self.pattern + after
 
     @staticmethod
     def _is_ascii(value):
-        return all(ord(char) < 128 for char in value)
+        return value.isascii()
 
     @staticmethod
     def Parse(line_no, input_data):
@@ -121,7 +181,7 @@ class Pattern(object):
 def parse(program):
     lines = program.split("\n")
 
-    p = Program([])
+    exprs = []
     commented_flag = False
     for line_no, line in enumerate(lines):
         if line.endswith('\r'):
@@ -149,57 +209,1958 @@ def parse(program):
         if right.keyword == KEYWORD_ONCE:
             raise A2BParseException(line_no, "Keyword(once) can't be placed on the right side of an expression")
         e = Expression(line_no, line, left, right)
-        p.exprs.append(e)
+        exprs.append(e)
 
-    return p
+    return Program(exprs)
 
-def printable_format(line):
-    return line
+class MultiPatternMatcher(object):
+    # Aho-Corasick automaton: output[node] lists every pattern index that
+    # ends at the current position once `node` has been reached.
+    def __init__(self, patterns):
+        self.lengths = [len(pattern) for pattern in patterns]
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]
+        for index, pattern in enumerate(patterns):
+            node = 0
+            for char in pattern:
+                child = self.goto[node].get(char)
+                if child is None:
+                    child = len(self.goto)
+                    self.goto[node][char] = child
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append([])
+                node = child
+            self.output[node].append(index)
 
-def execute(program, line, verbose=False):
-    if not Pattern._is_ascii(line) or '\n' in line or '\r' in line:
-        raise A2BExecutionException("Input must be one line of ASCII text")
-    if len(line) > LINE_LENGTH_LIMIT:
-        raise A2BExecutionException("String Length Limit Exceeded")
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self.goto[node].items():
+                queue.append(child)
+                fallback = self.fail[node]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(char, 0)
+                self.output[child] = (self.output[child] +
+                                      self.output[self.fail[child]])
+
+class RuleTable(object):
+    # Rules grouped by distinct non-empty left pattern; rules with an empty
+    # left side always match and are listed separately.
+    def __init__(self, program):
+        self.exprs = list(program.exprs)
+        self.keywords = [expr.left.keyword for expr in self.exprs]
+        self.empty_rules = []
+        self.patterns = []
+        self.pattern_rules = []
+        self.rule_patterns = []
+        indexes = {}
+        for index, expr in enumerate(self.exprs):
+            pattern = expr.left.pattern
+            if pattern == '':
+                self.empty_rules.append(index)
+                self.rule_patterns.append(-1)
+                continue
+            if pattern not in indexes:
+                indexes[pattern] = len(self.patterns)
+                self.patterns.append(pattern)
+                self.pattern_rules.append([])
+            self.pattern_rules[indexes[pattern]].append(index)
+            self.rule_patterns.append(indexes[pattern])
+        self.pattern_indexes = indexes
+        self.pattern_sizes = sorted(set(map(len, self.patterns)))
+
+def build_matcher(program):
+    return MultiPatternMatcher(program.compile('rules', RuleTable).patterns)
 
-    operation_counter = 0
+# How a compiled rule finds its left side and places its right side.
+MATCH_ANYWHERE = 0
+MATCH_START = 1
+MATCH_END = 2
+PLACE_INLINE = 0
+PLACE_START = 1
+PLACE_END = 2
+PLACE_RETURN = 3
 
+MATCH_KINDS = {KEYWORD_NONE: MATCH_ANYWHERE, KEYWORD_ONCE: MATCH_ANYWHERE,
+               KEYWORD_START: MATCH_START, KEYWORD_END: MATCH_END}
+PLACE_KINDS = {KEYWORD_NONE: PLACE_INLINE, KEYWORD_START: PLACE_START,
+               KEYWORD_END: PLACE_END, KEYWORD_RETURN: PLACE_RETURN}
+
+class CompiledRule(object):
+    # The execution form of one rule.  Expression.Execute tests for a match
+    # and then searches again to locate it; apply() searches once and builds
+    # the rewritten string from that position, and a miss returns None
+    # without allocating anything.
+    __slots__ = ('index', 'expr', 'once', 'match', 'pattern', 'size', 'place', 'replacement')
+
+    def __init__(self, index, expr):
+        self.index = index
+        self.expr = expr
+        self.once = expr.left.keyword == KEYWORD_ONCE
+        self.match = MATCH_KINDS[expr.left.keyword]
+        self.pattern = expr.left.pattern
+        self.size = len(expr.left.pattern)
+        self.place = PLACE_KINDS[expr.right.keyword]
+        self.replacement = expr.right.pattern
+
+    def apply(self, line):
+        match = self.match
+        if match == MATCH_ANYWHERE:
+            start = line.find(self.pattern)
+            if start < 0:
+                return None
+        elif match == MATCH_START:
+            if not line.startswith(self.pattern):
+                return None
+            start = 0
+        else:
+            if not line.endswith(self.pattern):
+                return None
+            start = len(line) - self.size
+        place = self.place
+        if place == PLACE_INLINE:
+            return line[:start] + self.replacement + line[start + self.size:]
+        if place == PLACE_RETURN:
+            return self.replacement
+        rest = line[:start] + line[start + self.size:]
+        if place == PLACE_START:
+            return self.replacement + rest
+        return rest + self.replacement
+
+def compiled_rules(program):
+    return tuple(CompiledRule(index, expr) for index, expr in enumerate(program.exprs))
+
+def character_gates(program):
+    # gates[char] has bit i set when rule i's left side contains char, so
+    # while the working string has no char those rules cannot match.
+    gates = {}
+    for index, expr in enumerate(program.exprs):
+        for char in set(expr.left.pattern):
+            gates[char] = gates.get(char, 0) | 1 << index
+    return gates
+
+def histogram_deltas(program):
+    # (char, change, gate) for every gating character whose count a rewrite
+    # by rule i changes; None for (return) rules, which replace the string.
+    gates = program.compile('gates', character_gates)
+    deltas = []
     for expr in program.exprs:
-        expr.executed = 0
+        if expr.right.keyword == KEYWORD_RETURN:
+            deltas.append(None)
+            continue
+        counts = Counter(expr.right.pattern)
+        counts.subtract(expr.left.pattern)
+        deltas.append(tuple((char, change, gates[char])
+                            for char, change in sorted(counts.items())
+                            if change and char in gates))
+    return deltas
 
-    while True:
-        executed = EXECUTED_NONE
-        for expr in program.exprs:
-            executed, output = expr.Execute(line)
-            if executed in [EXECUTED_DONE, EXECUTED_RETURN]:
-                operation_counter += 1
-                if verbose:
-                    print('Step %d:' % operation_counter, file=sys.stderr)
-                    print('  L%d: %s' % (expr.line_no + 1, expr.plain_text), file=sys.stderr)
-                    print('>> %s' % printable_format(line), file=sys.stderr)
-                    print('<< %s%s' % (
-                        '(return)' if executed == EXECUTED_RETURN else '',
-                        printable_format(output)), file=sys.stderr)
-                    print('', file=sys.stderr)
-                line = output
+class ScanEngine(object):
+    # Bit i of `dead` is set while rule i is known not to match the working
+    # string; it stays skipped until a rewrite that can enable it fires.
+    # `active` lists the rules still worth scanning: a (once) rule leaves it
+    # for good when it fires.  `counts` is the histogram of the characters
+    # rules need, and `blocked` masks the rules needing a character that is
+    # absent, so they are skipped without a search.
+    count = 1
+
+    def __init__(self, program, line, context):
+        self.exprs = program.exprs
+        self.active = program.compile('kernel', compiled_rules)
+        if context.once:
+            self.active = tuple(rule for rule in self.active if not context.spent(rule.index))
+        self.survivors = program.compile('survivors', surviving_rules)
+        self.gates = program.compile('gates', character_gates)
+        self.deltas = program.compile('deltas', histogram_deltas)
+        self.context = context
+        self.dead = 0
+        self.line = line
+        self.recount(line)
+
+    def recount(self, line):
+        self.counts = {char: line.count(char) for char in self.gates}
+        self.block()
+
+    def block(self):
+        counts = self.counts
+        blocked = 0
+        for char, gate in self.gates.items():
+            if not counts[char]:
+                blocked |= gate
+        self.blocked = blocked
+
+    def retire(self, index):
+        self.context.spend(index)
+        self.active = tuple(rule for rule in self.active if rule.index != index)
+
+    def step(self):
+        dead = self.dead | self.blocked
+        line = self.line
+        for rule in self.active:
+            index = rule.index
+            if dead >> index & 1:
+                continue
+            output = rule.apply(line)
+            if output is None:
+                dead |= 1 << index
+                continue
+            if rule.once:
+                self.retire(index)
+            self.dead = dead & self.survivors[index]
+            self.line = self.rewrite(index, rule.expr, output)
+            return rule.expr
+        self.dead = dead
+        return None
+
+    def rewrite(self, index, expr, output):
+        delta = self.deltas[index]
+        if delta:
+            self.update(delta)
+        elif delta is None:
+            self.recount(output)
+        return output
+
+    def update(self, delta):
+        counts = self.counts
+        for char, change, gate in delta:
+            before = counts[char]
+            total = counts[char] = before + change * self.count
+            if not total:
+                self.blocked |= gate
+            elif not before:
+                self.block()
+
+    def value(self):
+        return self.line
+
+    def __len__(self):
+        return len(self.line)
+
+# The automaton spends as long on one character in Python as a find spends
+# on AUTOMATON_CHARACTER_COST characters, and a find costs about as much as
+# searching AUTOMATON_FIND_OVERHEAD characters.  With these, a find per
+# distinct pattern is the cheaper search unless there are more than a
+# hundred or so patterns.
+AUTOMATON_CHARACTER_COST = 200
+AUTOMATON_FIND_OVERHEAD = 128
+
+class AutomatonEngine(object):
+    # Each step searches with whichever of the automaton and a find per
+    # distinct pattern is estimated to be cheaper for the current string.
+    count = 1
+
+    def __init__(self, program, line, context):
+        self.program = program.compile('rules', RuleTable)
+        self.matcher = program.compile('automaton', build_matcher)
+        self.context = context
+        self.line = line
+
+    def first_match(self):
+        length = len(self.line)
+        finds = len(self.program.patterns) * (AUTOMATON_FIND_OVERHEAD + length)
+        if finds < AUTOMATON_CHARACTER_COST * (length + 16):
+            return self.find_match()
+        return self.automaton_match()
+
+    def find_match(self):
+        program = self.program
+        once = self.context.once
+        line = self.line
+        missing = set()
+        for index, keyword in enumerate(program.keywords):
+            if once >> index & 1:
+                continue
+            pattern_index = program.rule_patterns[index]
+            if pattern_index < 0:
+                return index, len(line) if keyword == KEYWORD_END else 0
+            pattern = program.patterns[pattern_index]
+            if keyword == KEYWORD_START:
+                if line.startswith(pattern):
+                    return index, 0
+            elif keyword == KEYWORD_END:
+                if line.endswith(pattern):
+                    return index, len(line) - len(pattern)
+            elif pattern_index not in missing:
+                start = line.find(pattern)
+                if start >= 0:
+                    return index, start
+                missing.add(pattern_index)
+        return None, 0
+
+    def automaton_match(self):
+        program = self.program
+        keywords = program.keywords
+        once = self.context.once
+        line = self.line
+        length = len(line)
+
+        best = len(program.exprs)
+        best_start = 0
+        for index in program.empty_rules:
+            if not once >> index & 1:
+                best = index
+                best_start = length if keywords[index] == KEYWORD_END else 0
+                break
+
+        # No rule can beat the first one that is still allowed to fire.
+        floor = 0
+        while once >> floor & 1:
+            floor += 1
+
+        matcher = self.matcher
+        goto, fail, output = matcher.goto, matcher.fail, matcher.output
+        lengths = matcher.lengths
+        pattern_rules = program.pattern_rules
+        node = 0
+        for position, char in enumerate(line):
+            if best == floor:
                 break
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            for pattern_index in output[node]:
+                start = position + 1 - lengths[pattern_index]
+                for index in pattern_rules[pattern_index]:
+                    if index >= best:
+                        break
+                    if once >> index & 1:
+                        continue
+                    keyword = keywords[index]
+                    if keyword == KEYWORD_START and start:
+                        continue
+                    if keyword == KEYWORD_END and position + 1 != length:
+                        continue
+                    best, best_start = index, start
+                    break
+
+        if best == len(program.exprs):
+            return None, 0
+        return best, best_start
+
+    def step(self):
+        index, start = self.first_match()
+        if index is None:
+            return None
+        expr = self.program.exprs[index]
+        if expr.left.keyword == KEYWORD_ONCE:
+            self.context.spend(index)
+        end = start + len(expr.left.pattern)
+        self.line = expr.right.rewrite(self.line, start, end)
+        return expr
+
+    def value(self):
+        return self.line
+
+    def __len__(self):
+        return len(self.line)
+
+class Occurrences(object):
+    # Sorted start positions of one pattern, split at a cursor the way
+    # GapBuffer splits its text.  Positions left of the cursor count from
+    # the start of the string and positions right of it from the end, both
+    # against a lazy base, so a splice only moves the occurrences between
+    # the cursor and the edit instead of shifting every later one.
+    __slots__ = ('head', 'tail', 'head_base', 'tail_base')
+
+    def __init__(self, positions, length):
+        self.head = deque()
+        self.tail = deque(length - position for position in reversed(positions))
+        self.head_base = self.tail_base = 0
+
+    def __bool__(self):
+        return bool(self.head or self.tail)
+
+    def first(self, length):
+        if self.head:
+            return self.head[0] + self.head_base
+        return length - self.tail[-1] - self.tail_base
+
+    def last(self, length):
+        if self.tail:
+            return length - self.tail[0] - self.tail_base
+        return self.head[-1] + self.head_base
+
+    def splice(self, length, delta, low, end, found):
+        # A span ending at `end` was replaced, growing the string by `delta`
+        # to `length`.  Occurrences starting in [low, end) overlapped it and
+        # are dropped, later ones move with the end of the string, and
+        # `found` are the occurrences in the edited window.
+        old = length - delta
+        head, tail = self.head, self.tail
+        if not (head or tail):
+            head.extend(position - self.head_base for position in found)
+        elif self.first(old) >= end:
+            self.head_base += delta
+            base = self.head_base
+            head.extendleft(position - base for position in reversed(found))
+        elif self.last(old) < low:
+            self.tail_base += delta
+            base = self.tail_base
+            tail.extendleft(length - position - base for position in found)
         else:
-            break
-        
-        if operation_counter > EXECUTOR_OPERATION_LIMIT:
-            raise A2BExecutionException("Time Limit Exceeded")
+            head_base, tail_base = self.head_base, self.tail_base
+            while head and head[-1] + head_base >= low:
+                position = head.pop() + head_base
+                if position >= end:
+                    tail.append(old - position - tail_base)
+            while tail and old - tail[-1] - tail_base < end:
+                position = old - tail.pop() - tail_base
+                if position < low:
+                    head.append(position - head_base)
+            head.extend(position - head_base for position in found)
+
+# Below this length a find per rule is cheaper than keeping the index up to
+# date: on the marker sweeps the index is made for, the two cross at a few
+# thousand characters.
+INCREMENTAL_MIN_LENGTH = 4096
+
+class IncrementalEngine(object):
+    # Keeps the start positions of every left pattern as Occurrences.  A
+    # rewrite is a splice of the working string, after which only
+    # occurrences that overlap the edited window are dropped and searched
+    # for again.  While the string is shorter than INCREMENTAL_MIN_LENGTH
+    # (half of it once indexed) the steps are left to a ScanEngine.
+    count = 1
+
+    def __init__(self, program, line, context):
+        self.source = program
+        self.program = program.compile('rules', RuleTable)
+        self.context = context
+        self.line = line
+        self.scan = None
+        if len(line) >= INCREMENTAL_MIN_LENGTH:
+            self.index()
+        else:
+            self.scan = ScanEngine(program, line, context)
+
+    def index(self):
+        self.occurrences = []
+        for pattern in self.program.patterns:
+            positions = []
+            start = self.line.find(pattern)
+            while start >= 0:
+                positions.append(start)
+                start = self.line.find(pattern, start + 1)
+            self.occurrences.append(Occurrences(positions, len(self.line)))
+
+    def splice(self, start, end, text):
+        line = self.line = self.line[:start] + text + self.line[end:]
+        inserted = len(text)
+        length = len(line)
+        delta = inserted - (end - start)
+        patterns = self.program.patterns
+        indexes = self.program.pattern_indexes
+        # New occurrences overlap the inserted text or straddle the splice,
+        # so they are looked up by the few substrings that do.
+        found = {}
+        for size in self.program.pattern_sizes:
+            for position in range(max(0, start - size + 1), min(start + inserted, length - size + 1)):
+                index = indexes.get(line[position:position + size])
+                if index is not None:
+                    found.setdefault(index, []).append(position)
+        for index, occurrences in enumerate(self.occurrences):
+            positions = found.get(index, ())
+            if positions or occurrences.head or occurrences.tail:
+                occurrences.splice(
+                    length, delta, start - len(patterns[index]) + 1, end, positions)
+
+    def first_match(self):
+        program = self.program
+        length = len(self.line)
+        once = self.context.once
+        for index, keyword in enumerate(program.keywords):
+            if once >> index & 1:
+                continue
+            pattern_index = program.rule_patterns[index]
+            if pattern_index < 0:
+                return index, length if keyword == KEYWORD_END else 0
+            occurrences = self.occurrences[pattern_index]
+            if not occurrences:
+                continue
+            if keyword == KEYWORD_START:
+                if occurrences.first(length) == 0:
+                    return index, 0
+            elif keyword == KEYWORD_END:
+                start = occurrences.last(length)
+                if start + len(program.patterns[pattern_index]) == length:
+                    return index, start
+            else:
+                return index, occurrences.first(length)
+        return None, 0
+
+    def step(self):
+        if self.scan is not None:
+            expr = self.scan.step()
+            self.line = self.scan.line
+            if len(self.line) >= INCREMENTAL_MIN_LENGTH:
+                self.scan = None
+                self.index()
+            return expr
+        index, start = self.first_match()
+        if index is None:
+            return None
+        expr = self.program.exprs[index]
+        if expr.left.keyword == KEYWORD_ONCE:
+            self.context.spend(index)
+        end = start + len(expr.left.pattern)
+        right = expr.right
+        if right.keyword == KEYWORD_RETURN:
+            self.line = right.pattern
+            self.index()
+        elif right.keyword == KEYWORD_START:
+            self.splice(start, end, '')
+            if right.pattern:
+                self.splice(0, 0, right.pattern)
+        elif right.keyword == KEYWORD_END:
+            self.splice(start, end, '')
+            if right.pattern:
+                self.splice(len(self.line), len(self.line), right.pattern)
+        else:
+            self.splice(start, end, right.pattern)
+        if len(self.line) < INCREMENTAL_MIN_LENGTH // 2:
+            self.scan = ScanEngine(self.source, self.line, self.context)
+        return expr
+
+    def value(self):
+        return self.line
+
+    def __len__(self):
+        return len(self.line)
+
+class GapBuffer(object):
+    # ASCII working string stored in a bytearray with a movable gap, so a
+    # local rewrite only moves the text between the old and the new gap.
+    def __init__(self, text=b''):
+        self.buf = bytearray(text)
+        self.gap_start = self.gap_end = len(self.buf)
+
+    @staticmethod
+    def encode(text):
+        return text.encode('ascii')
+
+    def __len__(self):
+        return len(self.buf) - (self.gap_end - self.gap_start)
+
+    def __str__(self):
+        return (self.buf[:self.gap_start] + self.buf[self.gap_end:]).decode('ascii')
+
+    def move_gap(self, position):
+        buf = self.buf
+        if position < self.gap_start:
+            count = self.gap_start - position
+            buf[self.gap_end - count:self.gap_end] = buf[position:self.gap_start]
+            self.gap_start = position
+            self.gap_end -= count
+        elif position > self.gap_start:
+            count = position - self.gap_start
+            buf[self.gap_start:position] = buf[self.gap_end:self.gap_end + count]
+            self.gap_start = position
+            self.gap_end += count
+
+    def splice(self, start, end, text):
+        self.move_gap(start)
+        self.gap_end += end - start
+        missing = len(text) - (self.gap_end - self.gap_start)
+        if missing > 0:
+            extra = max(missing, len(self.buf))
+            self.buf[self.gap_end:self.gap_end] = bytes(extra)
+            self.gap_end += extra
+        self.buf[self.gap_start:self.gap_start + len(text)] = text
+        self.gap_start += len(text)
+
+    def find(self, pattern):
+        buf = self.buf
+        position = buf.find(pattern, 0, self.gap_start)
+        if position >= 0:
+            return position
+        size = len(pattern)
+        if size > 1:
+            low = max(0, self.gap_start - size + 1)
+            window = buf[low:self.gap_start] + buf[self.gap_end:self.gap_end + size - 1]
+            position = window.find(pattern)
+            if position >= 0:
+                return low + position
+        position = buf.find(pattern, self.gap_end)
+        if position >= 0:
+            return position - (self.gap_end - self.gap_start)
+        return -1
+
+    def startswith(self, pattern):
+        if len(pattern) <= self.gap_start:
+            return self.buf.startswith(pattern)
+        if len(pattern) > len(self):
+            return False
+        rest = len(pattern) - self.gap_start
+        return self.buf[:self.gap_start] + self.buf[self.gap_end:self.gap_end + rest] == pattern
+
+    def endswith(self, pattern):
+        if len(pattern) <= len(self.buf) - self.gap_end:
+            return self.buf.endswith(pattern)
+        if len(pattern) > len(self):
+            return False
+        rest = len(pattern) - (len(self.buf) - self.gap_end)
+        return self.buf[self.gap_start - rest:self.gap_start] + self.buf[self.gap_end:] == pattern
+
+class BufferEngine(object):
+    # Reference rule scan over a pluggable working-string representation;
+    # a `str` is only materialised when the interpreter asks for value().
+    count = 1
+    buffer_class = GapBuffer
+
+    def __init__(self, program, line, context):
+        self.exprs = program.exprs
+        self.encoded = program.compile(('buffer', self.buffer_class), self.encode_program)
+        self.context = context
+        self.buffer = self.buffer_class(self.buffer_class.encode(line))
+
+    def encode_program(self, program):
+        encode = self.buffer_class.encode
+        return [(encode(expr.left.pattern), encode(expr.right.pattern))
+                for expr in program.exprs]
+
+    def step(self):
+        buffer = self.buffer
+        context = self.context
+        for index, expr in enumerate(self.exprs):
+            if context.spent(index):
+                continue
+            left, right = self.encoded[index]
+            keyword = expr.left.keyword
+            if keyword == KEYWORD_START:
+                if not buffer.startswith(left):
+                    continue
+                start = 0
+            elif keyword == KEYWORD_END:
+                if not buffer.endswith(left):
+                    continue
+                start = len(buffer) - len(left)
+            else:
+                start = buffer.find(left)
+                if start < 0:
+                    continue
+            if keyword == KEYWORD_ONCE:
+                context.spend(index)
+
+            end = start + len(left)
+            if expr.right.keyword == KEYWORD_RETURN:
+                self.buffer = self.buffer_class(right)
+            elif expr.right.keyword == KEYWORD_START:
+                buffer.splice(start, end, b'')
+                buffer.splice(0, 0, right)
+            elif expr.right.keyword == KEYWORD_END:
+                buffer.splice(start, end, b'')
+                buffer.splice(len(buffer), len(buffer), right)
+            else:
+                buffer.splice(start, end, right)
+            return expr
+        return None
+
+    def value(self):
+        return str(self.buffer)
+
+    def __len__(self):
+        return len(self.buffer)
+
+def encode_rules(program):
+    return [(expr, expr.left.keyword, expr.left.pattern.encode('ascii'),
+             expr.right.keyword, expr.right.pattern.encode('ascii'))
+            for expr in program.exprs]
+
+class BytesEngine(object):
+    # Programs and inputs are ASCII-only, so the rewrite loop can run on a
+    # bytearray with in-place slice assignment; text is decoded on demand.
+    count = 1
+
+    def __init__(self, program, line, context):
+        self.rules = program.compile('bytes', encode_rules)
+        self.context = context
+        self.buf = bytearray(line.encode('ascii'))
+
+    def step(self):
+        buf = self.buf
+        for index, (expr, keyword, left, action, right) in enumerate(self.rules):
+            if keyword == KEYWORD_START:
+                if not buf.startswith(left):
+                    continue
+                start = 0
+            elif keyword == KEYWORD_END:
+                if not buf.endswith(left):
+                    continue
+                start = len(buf) - len(left)
+            else:
+                if keyword == KEYWORD_ONCE and self.context.spent(index):
+                    continue
+                start = buf.find(left)
+                if start < 0:
+                    continue
+                if keyword == KEYWORD_ONCE:
+                    self.context.spend(index)
+
+            end = start + len(left)
+            if action == KEYWORD_RETURN:
+                self.buf = bytearray(right)
+            elif action == KEYWORD_START:
+                del buf[start:end]
+                buf[0:0] = right
+            elif action == KEYWORD_END:
+                del buf[start:end]
+                buf += right
+            else:
+                buf[start:end] = right
+            return expr
+        return None
+
+    def value(self):
+        return self.buf.decode('ascii')
+
+    def __len__(self):
+        return len(self.buf)
+
+def can_overlap(pattern, text):
+    # Whether some occurrence of `pattern` can share a position with an
+    # occurrence of `text`, whatever surrounds them.
+    for offset in range(1 - len(pattern), len(text)):
+        low = max(offset, 0)
+        high = min(offset + len(pattern), len(text))
+        if text[low:high] == pattern[low - offset:high - offset]:
+            return True
+    return False
+
+def can_enable(pattern, keyword, replacement):
+    # Whether rewriting one occurrence into `replacement` can make a rule
+    # with left side `pattern` match where it did not match before.  An empty
+    # pattern always matches, so it is either spent or it shadows the rule.
+    if not pattern:
+        return False
+    if replacement:
+        return can_overlap(pattern, replacement)
+    # Deleting text joins its neighbours, and may expose a new first or
+    # last character to anchored rules.
+    return len(pattern) > 1 or keyword in (KEYWORD_START, KEYWORD_END)
+
+def enabled_rules(program):
+    # enables[i] holds the rules that a rewrite by rule i can turn from not
+    # matching into matching.  Moving the right side to either end also
+    # joins the text around the removed match.
+    enables = []
+    for expr in program.exprs:
+        right = expr.right
+        moved = right.keyword in (KEYWORD_START, KEYWORD_END)
+        enables.append(frozenset(
+            index for index, other in enumerate(program.exprs)
+            if can_enable(other.left.pattern, other.left.keyword, right.pattern) or
+            (moved and can_enable(other.left.pattern, other.left.keyword, ''))))
+    return enables
+
+def surviving_rules(program):
+    # Masks that keep the dead bits a rewrite by each rule cannot clear.
+    everything = (1 << len(program.exprs)) - 1
+    return [everything & ~sum(1 << index for index in enables)
+            for enables in enabled_rules(program)]
+
+def bulk_rules(program):
+    # A plain rule can be applied to every remaining occurrence at once when
+    # its rewrite neither creates a new occurrence of its own left side nor
+    # enables a rule above it: each following step would pick it again at
+    # the next occurrence, exactly as str.replace does.
+    bulk = []
+    for index, expr in enumerate(program.exprs):
+        left = expr.left.pattern
+        right = expr.right.pattern
+        bulk.append(
+            expr.left.keyword == KEYWORD_NONE and expr.right.keyword == KEYWORD_NONE and
+            left != '' and not can_enable(left, KEYWORD_NONE, right) and
+            not any(can_enable(other.left.pattern, other.left.keyword, right)
+                    for other in program.exprs[:index]))
+    return bulk
+
+def shadows(earlier, later):
+    # Whether `later` can only match when `earlier`, which comes first and is
+    # never spent, matches too.
+    pattern = earlier.left.pattern
+    if earlier.left.keyword == KEYWORD_ONCE:
+        return False
+    if earlier.left.keyword == KEYWORD_NONE:
+        return pattern in later.left.pattern
+    if pattern == '':
+        return True
+    if later.left.keyword != earlier.left.keyword:
+        return False
+    if earlier.left.keyword == KEYWORD_START:
+        return later.left.pattern.startswith(pattern)
+    return later.left.pattern.endswith(pattern)
+
+def optimize(program, input_alphabet=None):
+    # Drops rules that can never fire, so the result runs exactly the same
+    # steps.  A rule is dead when an earlier rule matches wherever it does,
+    # or when its left side needs a character that is neither in
+    # `input_alphabet` nor written by a live rule.  Returns the new program
+    # and the removed rules as (expr, reason) pairs.
+    exprs = program.exprs
+    reasons = {}
+    for index, expr in enumerate(exprs):
+        for earlier in exprs[:index]:
+            if shadows(earlier, expr):
+                reasons[index] = 'shadowed by line %d' % (earlier.line_no + 1)
+                break
+
+    if input_alphabet is not None:
+        # Grow the reachable characters until no live rule adds any.
+        reachable = set(input_alphabet)
+        changed = True
+        while changed:
+            changed = False
+            for index, expr in enumerate(exprs):
+                if index in reasons or not set(expr.left.pattern) <= reachable:
+                    continue
+                if not set(expr.right.pattern) <= reachable:
+                    reachable |= set(expr.right.pattern)
+                    changed = True
+        for index, expr in enumerate(exprs):
+            missing = sorted(set(expr.left.pattern) - reachable)
+            if index not in reasons and missing:
+                reasons[index] = 'needs unreachable %r' % ''.join(missing)
+
+    kept = [expr for index, expr in enumerate(exprs) if index not in reasons]
+    return Program(kept), [(exprs[index], reasons[index]) for index in sorted(reasons)]
+
+def marker_classes(program, input_alphabet):
+    # Sets of characters of which the working string never holds more than
+    # one occurrence in total.  Candidates are the characters inputs cannot
+    # contain, grouped by the rules that consume one and write another.  A
+    # group holds when no rule that can fire repeatedly adds to its count
+    # and the (once) rules together add at most one.  What a (return) rule
+    # writes ends the run, so it is never counted.
+    exprs = [expr for expr in program.exprs if expr.right.keyword != KEYWORD_RETURN]
+    candidates = set()
+    for expr in program.exprs:
+        candidates |= set(expr.left.pattern)
+    for expr in exprs:
+        candidates |= set(expr.right.pattern)
+    candidates -= set(input_alphabet)
+    groups = {char: {char} for char in candidates}
+    for expr in exprs:
+        for first in set(expr.left.pattern) & candidates:
+            for second in set(expr.right.pattern) & candidates:
+                if groups[first] is not groups[second]:
+                    merged = groups[first] | groups[second]
+                    for char in merged:
+                        groups[char] = merged
+    classes = []
+    for markers in {frozenset(group) for group in groups.values()}:
+        if holds_single_marker(program, markers):
+            classes.append(markers)
+    return sorted(classes, key=sorted)
+
+def holds_single_marker(program, markers):
+    # The proof for one class: starting from an input without markers,
+    # only (once) rules may add to their count, by at most one in total.
+    added = 0
+    for expr in program.exprs:
+        if expr.right.keyword == KEYWORD_RETURN:
+            continue
+        change = (sum(expr.right.pattern.count(char) for char in markers) -
+                  sum(expr.left.pattern.count(char) for char in markers))
+        if change > 0:
+            if expr.left.keyword != KEYWORD_ONCE:
+                return False
+            added += change
+    return added <= 1
+
+def exclusive(first, second, markers):
+    # Whether two rules can never match the same string while it holds at
+    # most one character of `markers`: each left side needs a marker, so
+    # both matches would sit on the one marker the string has, and once
+    # aligned on it the patterns disagree, or one reaches past the string
+    # start or end that the other is anchored to.
+    left = first.left.pattern
+    right = second.left.pattern
+    ours = [position for position, char in enumerate(left) if char in markers]
+    theirs = [position for position, char in enumerate(right) if char in markers]
+    if not ours or not theirs:
+        return False
+    if len(ours) > 1 or len(theirs) > 1 or left[ours[0]] != right[theirs[0]]:
+        return True
+    shift = ours[0] - theirs[0]
+    for position, char in enumerate(right):
+        if 0 <= position + shift < len(left) and left[position + shift] != char:
+            return True
+    # Offsets from the marker of where each match starts and ends.
+    spans = ((first.left.keyword, -ours[0], len(left) - ours[0]),
+             (second.left.keyword, -theirs[0], len(right) - theirs[0]))
+    for (keyword, start, end), (_, other_start, other_end) in (spans, spans[::-1]):
+        if keyword == KEYWORD_START and other_start < start:
+            return True
+        if keyword == KEYWORD_END and other_end > end:
+            return True
+    return False
+
+def reorder(program, hits, input_alphabet):
+    # Scans rules that fire more often first wherever that cannot change a
+    # run.  Consecutive rules that are pairwise exclusive under one marker
+    # class never match together, so whichever of them matches is the first
+    # to, in any order; each such group is sorted by `hits` (for example
+    # Profile.hits from a representative run).  Returns the new program and
+    # one obligation per reordered group: (the original indexes in their new
+    # order, the marker class), which check_reordering verifies.
+    exprs = program.exprs
+    classes = marker_classes(program, input_alphabet)
+    order = []
+    obligations = []
+    index = 0
+    while index < len(exprs):
+        best = [index]
+        best_markers = None
+        for markers in classes:
+            group = [index]
+            while (index + len(group) < len(exprs) and
+                   all(exclusive(exprs[member], exprs[index + len(group)], markers)
+                       for member in group)):
+                group.append(index + len(group))
+            if len(group) > len(best):
+                best, best_markers = group, markers
+        group = sorted(best, key=lambda member: -hits[member])
+        if group != best:
+            obligations.append((tuple(group), best_markers))
+        order.extend(group)
+        index += len(best)
+    return Program(exprs[member] for member in order), obligations
 
-        if len(line) > LINE_LENGTH_LIMIT:
-            raise A2BExecutionException("String Length Limit Exceeded")
+# check_reordering also runs both programs on this many of the shortest
+# inputs, with this step budget each.
+REORDER_CHECK_INPUTS = 256
+REORDER_CHECK_STEPS = 1000
 
-        if executed == EXECUTED_RETURN:
+def overlap_witness(first, second, markers):
+    # A string holding at most one character of `markers` that both left
+    # sides match, or None.  Any string both match can be cut down to the
+    # two matches, overlapping or side by side, without losing either or
+    # adding a marker, so it is enough to try every offset between them.
+    left, right = first.left.pattern, second.left.pattern
+    for shift in range(-len(right), len(left) + 1):
+        chars = dict(enumerate(left))
+        if any(chars.setdefault(position + shift, char) != char
+               for position, char in enumerate(right)):
+            continue
+        witness = ''.join(chars[position] for position in sorted(chars))
+        if (sum(map(witness.count, markers)) <= 1 and
+                first.left.match(witness) and second.left.match(witness)):
+            return witness
+    return None
+
+def marker_count_bound(program, markers):
+    # Counts, rule by rule, how far the number of characters of `markers`
+    # in the working string can rise from zero: a rule that can fire
+    # repeatedly and writes more of them than it consumes makes it
+    # unbounded, and each (once) rule adds its own rise a single time.
+    # (return) rules end the run, so what they write is never scanned.
+    bound = 0
+    for expr in program.exprs:
+        if expr.right.keyword == KEYWORD_RETURN:
+            continue
+        written = Counter(char for char in expr.right.pattern if char in markers)
+        consumed = Counter(char for char in expr.left.pattern if char in markers)
+        rise = sum(written.values()) - sum(consumed.values())
+        if rise <= 0:
+            continue
+        if expr.left.keyword != KEYWORD_ONCE:
+            return float('inf')
+        bound += rise
+    return bound
+
+def check_reordering(program, reordered, obligations, input_alphabet):
+    # Checks reorder()'s result without its proof: every obligation's
+    # rules were consecutive, nothing else moved, its class is disjoint
+    # from the inputs and never counts more than one marker, and no pair of
+    # its rules has an overlap_witness.  Both programs are also run on the
+    # shortest inputs and must agree on their outcomes and step counts.
+    exprs = list(program.exprs)
+    moved = set()
+    for group, markers in obligations:
+        start = min(group)
+        if sorted(group) != list(range(start, start + len(group))) or moved & set(group):
+            return False
+        moved |= set(group)
+        if markers & set(input_alphabet) or marker_count_bound(program, markers) > 1:
+            return False
+        if any(overlap_witness(program.exprs[first], program.exprs[second], markers) is not None
+               for first, second in itertools.combinations(group, 2)):
+            return False
+        exprs[start:start + len(group)] = [program.exprs[member] for member in group]
+    if exprs != list(reordered.exprs):
+        return False
+    inputs = itertools.chain.from_iterable(
+        map(''.join, itertools.product(sorted(set(input_alphabet)), repeat=length))
+        for length in range(REORDER_CHECK_INPUTS))
+    for value in itertools.islice(inputs, REORDER_CHECK_INPUTS):
+        outcomes = []
+        for candidate in (program, reordered):
+            context = ExecutionContext(REORDER_CHECK_STEPS, LINE_LENGTH_LIMIT)
+            outcomes.append((interpret(candidate, value, context), context.steps))
+        if outcomes[0] != outcomes[1]:
+            return False
+    return True
+
+class SweepIdiom(object):
+    # Xc=dX rules: the marker X walks right over a run of the family's
+    # characters, rewriting each c into d.  X must be the only marker.
+    def __init__(self, marker, outputs):
+        self.marker = marker
+        self.table = str.maketrans(outputs)
+        self.growth = {char: len(output) - 1 for char, output in outputs.items()}
+        self.grows = any(growth > 0 for growth in self.growth.values())
+        self.run = re.compile('[%s]*' % re.escape(''.join(outputs)))
+
+    def apply(self, line):
+        marker = self.marker
+        if line.count(marker) != 1:
+            return None
+        position = line.index(marker) + 1
+        run = self.run.match(line, position).group()
+        if not run:
+            return None
+        changes = [self.growth[char] for char in run] if self.grows else None
+        return (len(run), changes,
+                line[:position - 1] + run.translate(self.table) + marker + line[position + len(run):])
+
+class AppendIdiom(object):
+    # cX=(end)d rules: each step moves the character in front of a block of
+    # markers X to the end of the string as d, consuming one X, so the run
+    # in front of the block comes out reversed.
+    def __init__(self, marker, outputs):
+        self.marker = marker
+        self.outputs = outputs
+        self.growth = {char: len(output) - 2 for char, output in outputs.items()}
+        self.grows = any(growth > 0 for growth in self.growth.values())
+        self.block = re.compile('%s+' % re.escape(marker))
+
+    def apply(self, line):
+        marker = self.marker
+        start = line.find(marker)
+        if start < 0:
+            return None
+        end = self.block.match(line, start).end()
+        if line.count(marker) != end - start:
+            return None
+        first = start
+        while first > start - (end - start) and first > 0 and line[first - 1] in self.outputs:
+            first -= 1
+        run = line[first:start][::-1]
+        if not run:
+            return None
+        changes = [self.growth[char] for char in run] if self.grows else None
+        return (len(run), changes,
+                line[:first] + line[start + len(run):] + ''.join(self.outputs[char] for char in run))
+
+class SortIdiom(object):
+    # yx=xy rules over a total order: every maximal run of the ordered
+    # characters ends up sorted after one step per inversion.
+    def __init__(self, ranks):
+        self.ranks = ranks
+        self.segments = re.compile('[%s]{2,}' % re.escape(''.join(ranks)))
+
+    def apply(self, line):
+        ranks = self.ranks
+        order = len(ranks)
+        inversions = 0
+        pieces = []
+        last = 0
+        for segment in self.segments.finditer(line):
+            seen = [0] * order
+            for char in segment.group():
+                rank = ranks[char]
+                inversions += sum(seen[rank + 1:])
+                seen[rank] += 1
+            pieces.append(line[last:segment.start()])
+            pieces.append(''.join(sorted(segment.group(), key=ranks.__getitem__)))
+            last = segment.end()
+        if not inversions:
+            return None
+        pieces.append(line[last:])
+        return inversions, None, ''.join(pieces)
+
+def sort_idiom(program):
+    # The yx=xy rules form a sort when they order every pair of their
+    # characters one way, consistently; the rank of a character is the
+    # number of characters it moves past.
+    pairs = set()
+    members = []
+    for index, expr in enumerate(program.exprs):
+        left, right = expr.left, expr.right
+        if (left.keyword == KEYWORD_NONE and right.keyword == KEYWORD_NONE and
+                len(left.pattern) == 2 and left.pattern[0] != left.pattern[1] and
+                right.pattern == left.pattern[::-1]):
+            pairs.add(left.pattern)
+            members.append(index)
+    chars = sorted(set(''.join(pairs)))
+    if any((high + low in pairs) == (low + high in pairs)
+           for high, low in itertools.combinations(chars, 2)):
+        return None, []
+    ranks = {char: sum(char + other in pairs for other in chars) for char in chars}
+    if len(chars) < 2 or sorted(ranks.values()) != list(range(len(chars))):
+        return None, []
+    return SortIdiom(ranks), members
+
+def superoperators(program):
+    # idioms[i] is the idiom rule i belongs to when the steps that follow
+    # it firing can be computed at once, else None.  A family only counts
+    # when none of its rewrites can enable a rule above its last member,
+    # so nothing but the family fires until the idiom runs out; the rules
+    # above that are not members are its `guard`, checked once per use.
+    exprs = program.exprs
+    families = []
+    idiom, members = sort_idiom(program)
+    if idiom is not None:
+        families.append((idiom, members))
+    sorted_rules = set(members)
+
+    grouped = {}
+    for index, expr in enumerate(exprs):
+        left, right = expr.left, expr.right
+        if index in sorted_rules or left.keyword != KEYWORD_NONE or len(left.pattern) != 2:
+            continue
+        first, second = left.pattern
+        if first == second:
+            continue
+        if (right.keyword == KEYWORD_NONE and right.pattern.endswith(first) and
+                first not in right.pattern[:-1]):
+            key, char, output = (SweepIdiom, first), second, right.pattern[:-1]
+        elif right.keyword == KEYWORD_END and second not in right.pattern:
+            key, char, output = (AppendIdiom, second), first, right.pattern
+        else:
+            continue
+        outputs, indexes = grouped.setdefault(key, ({}, []))
+        # A repeated pattern never fires after the first one.
+        outputs.setdefault(char, output)
+        indexes.append(index)
+    for (kind, marker), (outputs, indexes) in grouped.items():
+        families.append((kind(marker, outputs), indexes))
+
+    enables = enabled_rules(program)
+    survivors = surviving_rules(program)
+    idioms = [None] * len(exprs)
+    for idiom, members in families:
+        top = max(members)
+        others = [index for index in range(top) if index not in members]
+        if any(index in enables[member] for member in members for index in others):
+            continue
+        idiom.guard = [(index, exprs[index]) for index in others]
+        idiom.survivors = -1
+        for member in members:
+            idiom.survivors &= survivors[member]
+        for member in members:
+            idioms[member] = idiom
+    return idioms
+
+class BulkEngine(ScanEngine):
+    # `count` is the number of steps the last call to step() stood for.  Runs
+    # are cut short at the step where a context limit would be exceeded, so
+    # callers see the same step count and outcome as the step-by-step engines.
+    # An idiom is only applied when all of its steps fit within the limits;
+    # otherwise the engine steps one rule at a time up to the limit.  Each
+    # step of an idiom's family takes one step off both the idiom and the
+    # budget, so once an idiom overruns the step limit it is `stalled` and
+    # not tried again until a rule outside its family fires.
+    def __init__(self, program, line, context):
+        ScanEngine.__init__(self, program, line, context)
+        self.bulk = program.compile('bulk', bulk_rules)
+        self.idioms = program.compile('idioms', superoperators)
+        self.stalled = None
+
+    def rewrite(self, index, expr, output):
+        self.count = 1
+        if self.bulk[index] or self.idioms[index] is not self.stalled:
+            self.stalled = None
+        if self.bulk[index]:
+            self.count = self.repeat(expr.left.pattern, expr.right.pattern)
+            output = self.line.replace(expr.left.pattern, expr.right.pattern, self.count)
+        elif self.idioms[index] is not None and self.stalled is None:
+            result = self.superoperator(self.idioms[index], output)
+            if result is not None:
+                self.count, output = result
+                self.dead &= self.idioms[index].survivors
+                self.recount(output)
+                return output
+        return ScanEngine.rewrite(self, index, expr, output)
+
+    def superoperator(self, idiom, output):
+        context = self.context
+        if context.max_length is not None and len(output) > context.max_length:
+            return None
+        result = idiom.apply(output)
+        if result is None:
+            return None
+        steps, changes, line = result
+        if context.max_steps is not None and context.steps + 1 + steps > context.max_steps:
+            self.stalled = idiom
+            return None
+        # The strings the idiom passes through never reach interpret(), so
+        # their longest is recorded here.  Without `changes` no step grows
+        # the string and the first one is the longest.
+        length = peak = len(output)
+        max_length = sys.maxsize if context.max_length is None else context.max_length
+        for change in changes or ():
+            length += change
+            if length > max_length:
+                return None
+            peak = max(peak, length)
+        for index, expr in idiom.guard:
+            if not context.spent(index) and expr.left.match(output):
+                return None
+        context.peak_length = max(context.peak_length, peak)
+        return 1 + steps, line
+
+    def repeat(self, pattern, replacement):
+        context = self.context
+        count = self.line.count(pattern)
+        if context.max_steps is not None:
+            count = min(count, context.max_steps - context.steps + 1)
+        growth = len(replacement) - len(pattern)
+        if context.max_length is not None and growth > 0:
+            count = min(count, (context.max_length - len(self.line)) // growth + 1)
+        return max(count, 1)
+
+# Program -> Python.  Each rule becomes straight-line str.find/startswith
+# checks on its constant pattern.  The generated module has step(line, once),
+# which fires one rule and returns (index, line, once) or None, and
+# run(line, max_steps, max_length), which runs the whole program with the
+# (once) flags as locals and returns (output, steps, limit).
+LIMIT_STEPS = 'steps'
+LIMIT_LENGTH = 'length'
+LIMIT_WORK = 'work'
+LIMIT_DEADLINE = 'deadline'
+LIMIT_CYCLE = 'cycle'
+LIMIT_STOPPED = 'stopped'
+PYTHON_CACHE_ENTRIES = 1024
+PYTHON_PROGRAMS = {}
+PYTHON_PROGRAMS_LOCK = threading.Lock()
+
+def exceeded(steps, length, max_steps, max_length):
+    # The limit broken by a step that leaves `steps` steps taken and a
+    # `length` long string, or None.  Every runner decides through this,
+    # so all of them report the step limit ahead of the length limit, and
+    # both ahead of a (return).
+    if steps > max_steps:
+        return LIMIT_STEPS
+    if length > max_length:
+        return LIMIT_LENGTH
+    return None
+
+def python_match(expr):
+    # The statement that finds the rule's match, or None when it always
+    # matches.  Plain patterns leave their offset in `position`.
+    left = expr.left
+    if left.pattern == '':
+        return None
+    if left.keyword == KEYWORD_START:
+        return 'if line.startswith(%r):' % left.pattern
+    if left.keyword == KEYWORD_END:
+        return 'if line.endswith(%r):' % left.pattern
+    return 'position = line.find(%r)\nif position >= 0:' % left.pattern
+
+def python_rewrite(expr):
+    left, right = expr.left, expr.right
+    if right.keyword == KEYWORD_RETURN:
+        return repr(right.pattern)
+    size = len(left.pattern)
+    if left.keyword == KEYWORD_END:
+        before, after = 'line[:-%d]' % size if size else 'line', ''
+    elif size == 0:
+        before, after = '', 'line'
+    elif left.keyword == KEYWORD_START:
+        before, after = '', 'line[%d:]' % size
+    else:
+        before, after = 'line[:position]', 'line[position + %d:]' % size
+    parts = [before, after]
+    if right.keyword == KEYWORD_START:
+        parts.insert(0, repr(right.pattern))
+    elif right.keyword == KEYWORD_END:
+        parts.append(repr(right.pattern))
+    else:
+        parts.insert(1, repr(right.pattern))
+    return ' + '.join(part for part in parts if part not in ('', "''")) or "''"
+
+def python_rule(index, expr, guard, fire):
+    # Source lines for one rule: `guard` skips spent (once) rules, `fire`
+    # is the body run when the rule matches.
+    lines = ['# %s' % expr.plain_text]
+    depth = 0
+    if guard is not None:
+        lines.append('if not %s:' % guard)
+        depth += 1
+    match = python_match(expr)
+    if match is not None:
+        lines.extend('    ' * depth + line for line in match.split('\n'))
+        depth += 1
+    lines.extend('    ' * depth + line for line in fire)
+    return lines, guard is None and match is None
+
+def python_source(program):
+    step = ['def step(line, once):']
+    run = ['def run(line, max_steps, max_length):',
+           '    if len(line) > max_length:',
+           '        return None, 0, %r' % LIMIT_LENGTH]
+    run.extend('    once_%d = False' % index for index, expr in enumerate(program.exprs)
+               if expr.left.keyword == KEYWORD_ONCE)
+    run.extend(['    steps = 0', '    while True:'])
+
+    for index, expr in enumerate(program.exprs):
+        once = expr.left.keyword == KEYWORD_ONCE
+        rewrite = python_rewrite(expr)
+
+        fire = ['return %d, %s, %s' % (index, rewrite, 'once | %d' % (1 << index) if once else 'once')]
+        lines, always = python_rule(index, expr, 'once & %d' % (1 << index) if once else None, fire)
+        step.extend('    ' + line for line in lines)
+
+        fire = ['line = %s' % rewrite]
+        if once:
+            fire.append('once_%d = True' % index)
+        fire.append('steps += 1')
+        # Rewrites that cannot grow the string cannot break the length limit.
+        if expr.right.keyword == KEYWORD_RETURN or len(expr.right.pattern) > len(expr.left.pattern):
+            fire.append('if steps > max_steps or len(line) > max_length:')
+        else:
+            fire.append('if steps > max_steps:')
+        fire.append('    return None, steps, exceeded(steps, len(line), max_steps, max_length)')
+        fire.append('return line, steps, None' if expr.right.keyword == KEYWORD_RETURN else 'continue')
+        lines, always = python_rule(index, expr, 'once_%d' % index if once else None, fire)
+        run.extend('        ' + line for line in lines)
+
+        if always:
             break
+    else:
+        step.append('    return None')
+        run.append('        return line, steps, None')
+    return '\n'.join(step + [''] + run) + '\n'
+
+class PythonProgram(object):
+    def __init__(self, source, name):
+        namespace = {'exceeded': exceeded}
+        exec(compile(source, name, 'exec'), namespace)
+        self.source = source
+        self.step = namespace['step']
+        self.run = namespace['run']
+
+def compile_python(program):
+    # Generated code is shared by every Program parsed from the same rules.
+    key = hashlib.sha256('\n'.join(expr.plain_text for expr in program.exprs)
+                         .encode('utf-8')).hexdigest()
+    with PYTHON_PROGRAMS_LOCK:
+        compiled = PYTHON_PROGRAMS.get(key)
+    if compiled is None:
+        compiled = PythonProgram(python_source(program), '<a2b %s>' % key[:12])
+        with PYTHON_PROGRAMS_LOCK:
+            compiled = PYTHON_PROGRAMS.setdefault(key, compiled)
+            if len(PYTHON_PROGRAMS) > PYTHON_CACHE_ENTRIES:
+                del PYTHON_PROGRAMS[next(iter(PYTHON_PROGRAMS))]
+    return compiled
+
+class PythonEngine(object):
+    count = 1
+
+    def __init__(self, program, line, context):
+        self.exprs = program.exprs
+        self.rules = program.compile('python', compile_python).step
+        self.context = context
+        self.line = line
+
+    def step(self):
+        fired = self.rules(self.line, self.context.once)
+        if fired is None:
+            return None
+        index, self.line, self.context.once = fired
+        return self.exprs[index]
+
+    def value(self):
+        return self.line
+
+    def __len__(self):
+        return len(self.line)
+
+# A program shaped like (once)=(start)M followed only by Mc=wN transitions
+# and (end)M rules is a left-to-right transducer: the single marker M is the
+# state and everything before it is output, so at most one rule can match at
+# a time and rule order does not matter.  Such programs run as a table loop
+# instead of a rewrite per character.
+FINAL_RETURN = 'return'
+FINAL_APPEND = 'append'
+FINAL_PREPEND = 'prepend'
+FINAL_RESTART = 'restart'
+
+class Transducer(object):
+    def __init__(self, start, markers, transitions, finals):
+        self.start = start
+        self.markers = markers
+        # (state, char) -> (output, next state or None when the marker is
+        # dropped); state -> (final kind, text).
+        self.transitions = transitions
+        self.finals = finals
+
+    def run(self, line, max_steps, max_length):
+        # Same (output, steps, limit) contract as generated run(); None when
+        # the input holds a marker, so the caller must use an engine.
+        if any(marker in line for marker in self.markers):
+            return None
+        if len(line) > max_length:
+            return None, 0, LIMIT_LENGTH
+        transitions = self.transitions
+        state = self.start
+        steps = 1
+        length = len(line) + 1
+        while True:
+            if steps > max_steps or length > max_length:
+                return None, steps, exceeded(steps, length, max_steps, max_length)
+            pieces = []
+            for position, char in enumerate(line):
+                rule = transitions.get((state, char))
+                if rule is None:
+                    return ''.join(pieces) + state + line[position:], steps, None
+                output, state = rule
+                steps += 1
+                length += len(output) - (1 if state is not None else 2)
+                if steps > max_steps or length > max_length:
+                    return None, steps, exceeded(steps, length, max_steps, max_length)
+                pieces.append(output)
+                if state is None:
+                    return ''.join(pieces) + line[position + 1:], steps, None
+            line = ''.join(pieces)
+            final = self.finals.get(state)
+            if final is None:
+                return line + state, steps, None
+            kind, text = final
+            steps += 1
+            if kind == FINAL_RESTART:
+                state = text
+                length = len(line) + 1
+                continue
+            if kind == FINAL_RETURN:
+                line = text
+            elif kind == FINAL_APPEND:
+                line = line + text
+            else:
+                line = text + line
+            if steps > max_steps or len(line) > max_length:
+                return None, steps, exceeded(steps, len(line), max_steps, max_length)
+            return line, steps, None
+
+def transducer(program):
+    exprs = program.exprs
+    if not exprs:
+        return None
+    first = exprs[0]
+    if (first.left.keyword != KEYWORD_ONCE or first.left.pattern or
+            first.right.keyword != KEYWORD_START or len(first.right.pattern) != 1):
+        return None
+    rest = exprs[1:]
+    markers = {first.right.pattern}
+    for expr in rest:
+        left = expr.left
+        if left.keyword == KEYWORD_NONE and len(left.pattern) == 2:
+            markers.add(left.pattern[0])
+        elif left.keyword == KEYWORD_END and len(left.pattern) == 1:
+            markers.add(left.pattern)
+        else:
+            return None
+
+    transitions = {}
+    finals = {}
+    for expr in rest:
+        left, right = expr.left, expr.right
+        text = right.pattern
+        if left.keyword == KEYWORD_NONE:
+            marker, char = left.pattern
+            if char in markers or right.keyword != KEYWORD_NONE:
+                return None
+            target = text[-1:] if text[-1:] in markers else None
+            output = text[:-1] if target is not None else text
+            if any(char in markers for char in output):
+                return None
+            # Only the first rule for a (state, char) pair can ever fire.
+            transitions.setdefault((marker, char), (output, target))
+            continue
+        if right.keyword == KEYWORD_RETURN:
+            final = FINAL_RETURN, text
+        elif right.keyword == KEYWORD_START and len(text) == 1 and text in markers:
+            final = FINAL_RESTART, text
+        elif any(char in markers for char in text):
+            return None
+        else:
+            final = FINAL_PREPEND if right.keyword == KEYWORD_START else FINAL_APPEND, text
+        finals.setdefault(left.pattern, final)
+    return Transducer(first.right.pattern, frozenset(markers), transitions, finals)
+
+class Profile(object):
+    # Per-rule counters filled in by ProfilingEngine.  `attempts` counts the
+    # match checks a rule cost, `copied` the characters written into new
+    # working strings by its rewrites, and `seconds` the time spent checking
+    # and applying it.
+    def __init__(self, program):
+        size = len(program.exprs)
+        self.exprs = program.exprs
+        self.hits = [0] * size
+        self.attempts = [0] * size
+        self.copied = [0] * size
+        self.seconds = [0.0] * size
+        self.peak_length = 0
+
+    @property
+    def steps(self):
+        return sum(self.hits)
 
-    return printable_format(line)
+    def rows(self):
+        order = sorted(range(len(self.exprs)), key=lambda index: (-self.seconds[index], index))
+        return [{
+            'line': self.exprs[index].line_no + 1,
+            'rule': self.exprs[index].plain_text,
+            'hits': self.hits[index],
+            'attempts': self.attempts[index],
+            'copied': self.copied[index],
+            'seconds': self.seconds[index],
+        } for index in order]
+
+    def as_dict(self):
+        return {
+            'steps': self.steps,
+            'peak_length': self.peak_length,
+            'copied': sum(self.copied),
+            'copied_per_step': sum(self.copied) / self.steps if self.steps else 0.0,
+            'rules': self.rows(),
+        }
+
+    def format_table(self):
+        lines = ['%6s %10s %10s %12s %10s  %s' % (
+            'line', 'hits', 'attempts', 'copied', 'seconds', 'rule')]
+        for row in self.rows():
+            lines.append('%6d %10d %10d %12d %10.4f  %s' % (
+                row['line'], row['hits'], row['attempts'], row['copied'],
+                row['seconds'], row['rule']))
+        summary = self.as_dict()
+        lines.append('steps: %d, peak length: %d, copied per step: %.1f' % (
+            summary['steps'], summary['peak_length'], summary['copied_per_step']))
+        return '\n'.join(lines)
+
+class ProfiledRule(object):
+    # Stands in for a CompiledRule and counts its match checks in a Profile.
+    __slots__ = ('rule', 'index', 'once', 'expr', 'profile')
+
+    def __init__(self, rule, profile):
+        self.rule = rule
+        self.index = rule.index
+        self.once = rule.once
+        self.expr = rule.expr
+        self.profile = profile
+
+    def apply(self, line):
+        profile = self.profile
+        index = self.index
+        begin = time.perf_counter()
+        output = self.rule.apply(line)
+        profile.seconds[index] += time.perf_counter() - begin
+        profile.attempts[index] += 1
+        if output is not None:
+            profile.hits[index] += 1
+            profile.copied[index] += len(output)
+            profile.peak_length = max(profile.peak_length, len(output))
+        return output
+
+class ProfilingEngine(ScanEngine):
+    # The reference scan with every match check timed and counted: its rules
+    # are swapped for ProfiledRules, so ScanEngine.step skips exactly the
+    # checks it skips in a plain run.  It is only used when a Profile is
+    # requested, so plain runs pay nothing.
+    def __init__(self, program, line, context, profile):
+        ScanEngine.__init__(self, program, line, context)
+        self.active = tuple(ProfiledRule(rule, profile) for rule in self.active)
+        self.profile = profile
+        profile.peak_length = max(profile.peak_length, len(line))
+
+TRACE_MAGIC = b'A2BT\x01'
+
+def little_endian(values):
+    if sys.byteorder == 'big':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+def from_little_endian(typecode, data):
+    values = array(typecode, data)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
+class TraceRecorder(object):
+    # Compact execution trace.  The rule index, match position and step
+    # delta of every `sample`-th step go into typed arrays, and the working
+    # string is checkpointed every `checkpoint_every` steps; any step's string
+    # is rebuilt by re-running the program from the nearest checkpoint.
+    # With a binary `stream`, records are written out in chunks and dropped
+    # from memory, and load() reads the file back.
+    flush_records = 4096
+
+    def __init__(self, program, line, sample=1, checkpoint_every=1024, stream=None):
+        if sample < 1 or checkpoint_every < 1:
+            raise ValueError('sample and checkpoint_every must be positive')
+        self.program = program
+        self.rule_index = {id(expr): index for index, expr in enumerate(program.exprs)}
+        self.sample = sample
+        self.checkpoint_every = checkpoint_every
+        self.stream = stream
+        self.rules = array('i')
+        self.positions = array('q')
+        self.deltas = array('q')
+        # Step of the last record before deltas[0]; earlier ones were flushed.
+        self.offset = 0
+        self.last = 0
+        self.steps = 0
+        self.checkpoint_steps = []
+        self.checkpoints = []
+        if stream is not None:
+            stream.write(TRACE_MAGIC + struct.pack('<qq', sample, checkpoint_every))
+        self.checkpoint(0, line, 0)
+
+    def checkpoint(self, step, line, once):
+        self.checkpoint_steps.append(step)
+        self.checkpoints.append((line, once))
+        if self.stream is not None:
+            once_bytes = once.to_bytes((once.bit_length() + 7) // 8, 'little')
+            text = line.encode('ascii')
+            self.stream.write(b'C' + struct.pack('<qII', step, len(once_bytes), len(text)) +
+                              once_bytes + text)
+
+    def record(self, expr, before, state, context):
+        step = self.steps = context.steps
+        if (step - 1) % self.sample == 0:
+            self.rules.append(self.rule_index[id(expr)])
+            self.positions.append(expr.left.match_span(before)[0])
+            self.deltas.append(step - self.last)
+            self.last = step
+            if self.stream is not None and len(self.rules) >= self.flush_records:
+                self.flush()
+        if step % self.checkpoint_every == 0:
+            self.checkpoint(step, state.value(), context.once)
+
+    def flush(self):
+        if self.rules:
+            self.stream.write(b'R' + struct.pack('<I', len(self.rules)) +
+                              little_endian(self.rules) + little_endian(self.positions) +
+                              little_endian(self.deltas))
+            self.offset = self.last
+            del self.rules[:], self.positions[:], self.deltas[:]
+
+    def close(self):
+        self.flush()
+        self.stream.write(b'E' + struct.pack('<q', self.steps))
+        self.stream.flush()
+
+    @classmethod
+    def load(cls, program, stream):
+        if stream.read(len(TRACE_MAGIC)) != TRACE_MAGIC:
+            raise ValueError('Not an A2B trace')
+        sample, checkpoint_every = struct.unpack('<qq', stream.read(16))
+        recorder = None
+        while True:
+            tag = stream.read(1)
+            if tag == b'C':
+                step, once_size, text_size = struct.unpack('<qII', stream.read(16))
+                once = int.from_bytes(stream.read(once_size), 'little')
+                line = stream.read(text_size).decode('ascii')
+                if recorder is None:
+                    recorder = cls(program, line, sample, checkpoint_every)
+                else:
+                    recorder.checkpoint_steps.append(step)
+                    recorder.checkpoints.append((line, once))
+            elif tag == b'R':
+                count, = struct.unpack('<I', stream.read(4))
+                recorder.rules.extend(from_little_endian('i', stream.read(4 * count)))
+                recorder.positions.extend(from_little_endian('q', stream.read(8 * count)))
+                recorder.deltas.extend(from_little_endian('q', stream.read(8 * count)))
+            elif tag == b'E':
+                recorder.steps, = struct.unpack('<q', stream.read(8))
+                recorder.last = recorder.offset + sum(recorder.deltas)
+                return recorder
+            else:
+                raise ValueError('Truncated A2B trace')
+
+    def value_at(self, step):
+        if not 0 <= step <= self.steps:
+            raise IndexError('step %d is outside the trace' % step)
+        position = bisect_right(self.checkpoint_steps, step) - 1
+        line, once = self.checkpoints[position]
+        context = ExecutionContext()
+        context.once = once
+        state = ScanEngine(self.program, line, context)
+        for _ in range(step - self.checkpoint_steps[position]):
+            state.step()
+        return state.value()
+
+    def entry(self, index, step):
+        expr = self.program.exprs[self.rules[index]]
+        return {
+            'step': step,
+            'rule_line': expr.line_no + 1,
+            'rule': expr.plain_text,
+            'before': self.value_at(step - 1),
+            'after': self.value_at(step),
+        }
+
+    def __len__(self):
+        return len(self.rules)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self.rules)
+        if not 0 <= index < len(self.rules):
+            raise IndexError('trace record out of range')
+        return self.entry(index, self.offset + sum(self.deltas[:index + 1]))
+
+    def __iter__(self):
+        step = self.offset
+        for index, delta in enumerate(self.deltas):
+            step += delta
+            yield self.entry(index, step)
+
+class CycleDetector(object):
+    # Brent's algorithm over interpreter configurations.  The saved
+    # configuration is replaced after runs of doubling length, so a cycle is
+    # confirmed within a few cycle lengths of being entered, in O(1) memory,
+    # and `distance` is then exactly the cycle length.
+    def __init__(self, configuration):
+        self.saved = configuration
+        self.power = self.distance = 1
+
+    def observe(self, configuration):
+        if configuration == self.saved:
+            return self.distance
+        if self.distance == self.power:
+            self.saved = configuration
+            self.power *= 2
+            self.distance = 0
+        self.distance += 1
+        return 0
+
+DEFAULT_ENGINE = 'scan'
+ENGINES = {
+    'scan': ScanEngine,
+    'automaton': AutomatonEngine,
+    'incremental': IncrementalEngine,
+    'gap': BufferEngine,
+    'bytes': BytesEngine,
+    'bulk': BulkEngine,
+    'python': PythonEngine,
+}
+# Engines that may stand for several steps per call to step().
+BULK_ENGINES = {'bulk'}
+
+def stepping_engine(engine):
+    # Traces, cycle detection and work budgets observe every configuration,
+    # so they run bulk engines' programs one step at a time instead.
+    return DEFAULT_ENGINE if engine in BULK_ENGINES else engine
+
+def start_engine(program, line, engine=DEFAULT_ENGINE, context=None):
+    if engine not in ENGINES:
+        raise ValueError('Unknown engine "%s"' % engine)
+    if context is None:
+        context = ExecutionContext()
+    return ENGINES[engine](program, line, context)
+
+def printable_format(line):
+    return line
+
+class VerboseObserver(object):
+    # Prints every step to stderr, as the --verbose flag does.
+    def record(self, expr, before, state, context):
+        print('Step %d:' % context.steps, file=sys.stderr)
+        print('  L%d: %s' % (expr.line_no + 1, expr.plain_text), file=sys.stderr)
+        print('>> %s' % printable_format(before), file=sys.stderr)
+        print('<< %s%s' % (
+            '(return)' if expr.right.keyword == KEYWORD_RETURN else '',
+            printable_format(state.value())), file=sys.stderr)
+        print('', file=sys.stderr)
+
+def interpret(program, line, context, engine=DEFAULT_ENGINE, detect_cycles=False,
+              observers=(), profile=None, before_step=None):
+    # The rewrite loop behind execute(), the dataset runners and traces.
+    # Each observer's record(expr, before, state, context) is called after
+    # every step, before the limits are checked; with a Profile the
+    # profiling engine runs instead.  before_step(state, context) is called
+    # on every configuration the engine stops at, before the step from it,
+    # and ends the run with LIMIT_STOPPED when it returns true.  Returns
+    # (limit, output, cycle): limit is None when the program halted, and
+    # otherwise the LIMIT_* that stopped it, in which case there is no
+    # output; cycle is the cycle length for LIMIT_CYCLE.  Callers validate
+    # the input themselves.
+    budgeted = context.max_work is not None
+    if observers or detect_cycles or budgeted:
+        engine = stepping_engine(engine)
+    if profile is not None:
+        state = ProfilingEngine(program, line, context, profile)
+    else:
+        state = start_engine(program, line, engine, context)
+    detector = CycleDetector((line, context.once)) if detect_cycles else None
+    max_steps = sys.maxsize if context.max_steps is None else context.max_steps
+    max_length = sys.maxsize if context.max_length is None else context.max_length
+    deadline = context.deadline
+    previous = len(line)
+    context.peak_length = max(context.peak_length, previous)
+
+    while True:
+        if before_step is not None and before_step(state, context):
+            return LIMIT_STOPPED, None, None
+        before = state.value() if observers else None
+        expr = state.step()
+        if expr is None:
+            return None, state.value(), None
+        context.steps += state.count
+        if observers:
+            for observer in observers:
+                observer.record(expr, before, state, context)
+
+        length = len(state)
+        if length > context.peak_length:
+            context.peak_length = length
+        if context.steps > max_steps or length > max_length:
+            return exceeded(context.steps, length, max_steps, max_length), None, None
+
+        if budgeted:
+            context.work += previous + length
+            previous = length
+            if context.work > context.max_work:
+                return LIMIT_WORK, None, None
+
+        if deadline is not None and time.perf_counter() > deadline:
+            return LIMIT_DEADLINE, None, None
+
+        if expr.right.keyword == KEYWORD_RETURN:
+            return None, state.value(), None
+
+        if detector is not None:
+            cycle = detector.observe((state.value(), context.once))
+            if cycle:
+                return LIMIT_CYCLE, None, cycle
+
+LIMIT_ERRORS = {
+    LIMIT_STEPS: "Time Limit Exceeded",
+    LIMIT_LENGTH: "String Length Limit Exceeded",
+    LIMIT_WORK: "Work Limit Exceeded",
+    LIMIT_DEADLINE: "Deadline Exceeded",
+}
+
+def execute(program, line, verbose=False, engine=DEFAULT_ENGINE, detect_cycles=False,
+            max_steps=None, max_length=None, profile=None, trace=None, context=None,
+            max_work=None, timeout=None):
+    # The module-level limits are only defaults; a run never writes shared
+    # state, so concurrent calls may use different limits.  A caller-supplied
+    # context carries its own limits (None meaning unlimited) and keeps the
+    # step count afterwards, so limits cannot also be passed as arguments.
+    if context is None:
+        context = ExecutionContext(
+            EXECUTOR_OPERATION_LIMIT if max_steps is None else max_steps,
+            LINE_LENGTH_LIMIT if max_length is None else max_length,
+            max_work, None if timeout is None else time.perf_counter() + timeout)
+    elif any(limit is not None for limit in (max_steps, max_length, max_work, timeout)):
+        raise ValueError('Pass limits either in the context or as arguments, not both')
+    if not Pattern._is_ascii(line) or '\n' in line or '\r' in line:
+        raise A2BExecutionException("Input must be one line of ASCII text")
+    if context.max_length is not None and len(line) > context.max_length:
+        raise A2BExecutionException("String Length Limit Exceeded")
+
+    observers = []
+    if trace is not None:
+        observers.append(trace)
+    if verbose:
+        observers.append(VerboseObserver())
+    limit, output, cycle = interpret(program, line, context, engine, detect_cycles,
+                                     observers, profile)
+    if limit == LIMIT_CYCLE:
+        raise A2BExecutionException("Infinite Loop Detected (Cycle Length %d)" % cycle)
+    if limit is not None:
+        raise A2BExecutionException(LIMIT_ERRORS[limit])
+    return printable_format(output)
+
+def read_batch(text):
+    # A file whose first line is a JSON object is a JSONL testcase file and
+    # yields (input, expected output) pairs; every other line must then be
+    # a case too.  Any other text, including plain inputs that merely start
+    # with '{', is taken as one input per line, with nothing to compare
+    # against.
+    lines = text.splitlines()
+    try:
+        first = json.loads(lines[0]) if lines else None
+    except ValueError:
+        first = None
+    if not isinstance(first, dict):
+        return [(line, None) for line in lines]
+    cases = []
+    for line_no, line in enumerate(lines):
+        if not line.strip():
+            continue
+        try:
+            case = json.loads(line)
+        except ValueError:
+            case = None
+        if not isinstance(case, dict) or not isinstance(case.get('input'), str):
+            raise ValueError('Line %d of the batch file is not a case with an "input" string'
+                             % (line_no + 1))
+        cases.append((case['input'], case.get('output')))
+    return cases
+
+def run_case(program, line, engine=DEFAULT_ENGINE, max_work=None, timeout=None):
+    begin = time.perf_counter()
+    context = ExecutionContext(EXECUTOR_OPERATION_LIMIT, LINE_LENGTH_LIMIT, max_work,
+                               None if timeout is None else begin + timeout)
+    try:
+        output = execute(program, line, engine=engine, context=context)
+        status = 'ok'
+    except A2BExecutionException as error:
+        output = None
+        status = error.description
+    return {
+        'output': output,
+        'steps': context.steps,
+        'status': status,
+        'elapsed': time.perf_counter() - begin,
+    }
+
+def run_batch(program, cases, engine=DEFAULT_ENGINE, jobs=1, max_work=None, timeout=None):
+    inputs = [line for line, _ in cases]
+    run = partial(run_case, program, engine=engine, max_work=max_work, timeout=timeout)
+    if jobs > 1 and len(inputs) > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            results = list(pool.map(run, inputs, chunksize=-(-len(inputs) // (jobs * 4))))
+    else:
+        results = [run(line) for line in inputs]
+    for result, (_, expected) in zip(results, cases):
+        if expected is not None:
+            result['passed'] = result['output'] == expected
+    return results
 
 if __name__ == '__main__':
     argparser = argparse.ArgumentParser(description='A2B lang interpreter')
     argparser.add_argument('-v', '--verbose', dest='verbose', action='store_true')
+    argparser.add_argument('--engine', choices=sorted(ENGINES), default=DEFAULT_ENGINE)
+    argparser.add_argument('--profile', action='store_true',
+                           help='print per-rule counters to stderr')
+    argparser.add_argument('--profile-format', choices=['table', 'json'], default='table')
+    argparser.add_argument('--trace', metavar='PATH',
+                           help='stream a compact binary trace to PATH')
+    argparser.add_argument('--trace-sample', type=int, default=1, metavar='N',
+                           help='record every Nth step of the trace')
+    argparser.add_argument('--batch', metavar='PATH',
+                           help='run every input of a JSONL testcase file or newline-delimited '
+                                'input file ("-" for stdin) and print one JSON result per line')
+    argparser.add_argument('--jobs', type=int, default=1, metavar='N',
+                           help='worker processes for --batch')
+    argparser.add_argument('--max-work', type=int, metavar='CHARS',
+                           help='stop once the characters scanned and copied exceed CHARS')
+    argparser.add_argument('--timeout', type=float, metavar='SECONDS',
+                           help='stop a run after SECONDS of wall-clock time')
+    argparser.add_argument('--optimize', action='store_true',
+                           help='drop rules that can never fire and list them on stderr')
+    argparser.add_argument('--alphabet', metavar='CHARS',
+                           help='characters inputs may contain, for --optimize')
     argparser.add_argument('filename')
     argparser.set_defaults(verbose=False)
     args = argparser.parse_args()
@@ -208,6 +2169,37 @@ if __name__ == '__main__':
         plain_text = input_file.read()
         program = parse(plain_text)
 
+    if args.optimize:
+        program, removed = optimize(program, args.alphabet)
+        for expr, reason in removed:
+            print('line %d: %s (%s)' % (expr.line_no + 1, expr.plain_text, reason), file=sys.stderr)
+
+    if args.batch:
+        if args.batch == '-':
+            batch_text = sys.stdin.read()
+        else:
+            with open(args.batch, encoding='utf-8') as batch_file:
+                batch_text = batch_file.read()
+        results = run_batch(program, read_batch(batch_text), args.engine, args.jobs,
+                            args.max_work, args.timeout)
+        for result in results:
+            print(json.dumps(result))
+        sys.exit(1 if any(result.get('passed') is False for result in results) else 0)
+
     line = input()
-    result = execute(program, line, args.verbose)
+    profile = Profile(program) if args.profile else None
+    trace_file = open(args.trace, 'wb') if args.trace else None
+    trace = TraceRecorder(program, line, args.trace_sample, stream=trace_file) if trace_file else None
+    try:
+        result = execute(program, line, args.verbose, args.engine, profile=profile, trace=trace,
+                         max_work=args.max_work, timeout=args.timeout)
+    finally:
+        if trace is not None:
+            trace.close()
+            trace_file.close()
+        if profile is not None:
+            if args.profile_format == 'json':
+                print(json.dumps(profile.as_dict(), indent=2), file=sys.stderr)
+            else:
+                print(profile.format_table(), file=sys.stderr)
     print(result)
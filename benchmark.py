@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+
+import argparse
+import time
+
+import A2B
+
+# A marker walks from the start of the input to its end, so every step is a
+# small edit next to the marker while the rest of the string is untouched.
+# That isolates the cost of the working-string representation.
+SWEEP_PROGRAM = "\n".join((
+    "(once)=(start)X",
+    "Xa=bX",
+    "Xb=aX",
+    "X=",
+))
+
+DEFAULT_LENGTHS = (1000, 10000, 100000)
+DEFAULT_STEPS = 2000
+
+def sweep_input(length):
+    return ('ab' * (length // 2 + 1))[:length]
+
+def measure(program, line, engine, max_steps):
+    context = A2B.ExecutionContext(max_steps=max_steps - 1)
+    state = A2B.start_engine(program, line, engine, context)
+    begin = time.perf_counter()
+    while context.steps < max_steps and state.step() is not None:
+        context.steps += state.count
+    state.value()
+    return context.steps, time.perf_counter() - begin
+
+class NullObserver(object):
+    def record(self, expr, before, state, context):
+        pass
+
+# How the shared interpreter core is driven: a bare step() loop as the
+# floor, the core with no observers (what execute() and the dataset
+# runners use) and the core with one observer that does nothing.
+CORE_MODES = ('loop', 'core', 'observed')
+
+def measure_core(program, line, mode, max_steps):
+    if mode == 'loop':
+        return measure(program, line, A2B.DEFAULT_ENGINE, max_steps)
+    context = A2B.ExecutionContext(max_steps - 1)
+    observers = (NullObserver(),) if mode == 'observed' else ()
+    begin = time.perf_counter()
+    A2B.interpret(program, line, context, observers=observers)
+    return context.steps, time.perf_counter() - begin
+
+def run_core(lengths, max_steps):
+    # Every mode is timed once per rotation of CORE_MODES, so each goes
+    # first once and warm-up does not favour any of them; the fastest time
+    # is kept.
+    program = A2B.parse(SWEEP_PROGRAM)
+    rows = []
+    for length in lengths:
+        line = sweep_input(length)
+        best = {}
+        for shift in range(len(CORE_MODES)):
+            for mode in CORE_MODES[shift:] + CORE_MODES[:shift]:
+                steps, elapsed = measure_core(program, line, mode, max_steps)
+                if mode not in best or elapsed < best[mode][1]:
+                    best[mode] = steps, elapsed
+        for mode in CORE_MODES:
+            rows.append((mode, length) + best[mode])
+    return rows
+
+def run(engines, lengths, max_steps):
+    program = A2B.parse(SWEEP_PROGRAM)
+    rows = []
+    for length in lengths:
+        line = sweep_input(length)
+        for engine in engines:
+            steps, elapsed = measure(program, line, engine, max_steps)
+            rows.append((engine, length, steps, elapsed))
+    return rows
+
+if __name__ == '__main__':
+    argparser = argparse.ArgumentParser(description='A2B interpreter steps/sec benchmark')
+    argparser.add_argument('--engine', dest='engines', action='append',
+                           choices=sorted(A2B.ENGINES))
+    argparser.add_argument('--length', dest='lengths', action='append', type=int)
+    argparser.add_argument('--steps', type=int, default=DEFAULT_STEPS)
+    argparser.add_argument('--core', action='store_true',
+                           help='compare the interpreter core with and without observers')
+    args = argparser.parse_args()
+
+    engines = args.engines or sorted(A2B.ENGINES)
+    lengths = args.lengths or DEFAULT_LENGTHS
+    if args.core:
+        rows = run_core(lengths, args.steps)
+    else:
+        rows = run(engines, lengths, args.steps)
+    print('%-12s %8s %8s %10s %12s' % ('engine', 'length', 'steps', 'seconds', 'steps/sec'))
+    for engine, length, steps, elapsed in rows:
+        print('%-12s %8d %8d %10.4f %12.0f' % (
+            engine, length, steps, elapsed, steps / elapsed if elapsed else 0))
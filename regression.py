@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import math
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from pathlib import Path
+
+import A2B
+
+# Runs every bundled solution over its full test suite and records how long
+# the interpreter took, so interpreter changes can be checked against a
+# saved baseline for both correctness and speed.
+TASKS_DIR = Path(__file__).parent / 'tasks'
+DEFAULT_THRESHOLD = 0.25
+
+def discover(tasks_dir=TASKS_DIR, names=None):
+    tasks = sorted(path.parent for path in Path(tasks_dir).glob('*/solution.a2b'))
+    if names:
+        tasks = [task for task in tasks if task.name in names]
+    return tasks
+
+def percentile(values, fraction):
+    # Nearest-rank percentile of a sorted list.
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, max(0, math.ceil(fraction * len(values)) - 1))]
+
+def run_task(task, engine=A2B.DEFAULT_ENGINE):
+    program = A2B.parse((task / 'solution.a2b').read_text(encoding='utf-8'))
+    with open(task / 'testcase_full.jsonl', encoding='utf-8') as cases_file:
+        cases = [json.loads(line) for line in cases_file if line.strip()]
+
+    latencies = []
+    steps = 0
+    peak_length = 0
+    failures = []
+    for case in cases:
+        context = A2B.ExecutionContext(A2B.EXECUTOR_OPERATION_LIMIT, A2B.LINE_LENGTH_LIMIT)
+        begin = time.perf_counter()
+        try:
+            output = A2B.execute(program, case['input'], engine=engine, context=context)
+        except A2B.A2BExecutionException as error:
+            output = error.description
+        latencies.append(time.perf_counter() - begin)
+        steps += context.steps
+        peak_length = max(peak_length, context.peak_length)
+        if output != case['output']:
+            failures.append(case['input'])
+
+    seconds = sum(latencies)
+    latencies.sort()
+    return {
+        'task': task.name,
+        'cases': len(cases),
+        'failures': failures,
+        'steps': steps,
+        'seconds': seconds,
+        'steps_per_sec': steps / seconds if seconds else 0.0,
+        'p50': percentile(latencies, 0.5),
+        'p99': percentile(latencies, 0.99),
+        'peak_length': peak_length,
+    }
+
+def run(tasks, engine=A2B.DEFAULT_ENGINE, jobs=1):
+    if jobs > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            results = list(pool.map(partial(run_task, engine=engine), tasks))
+    else:
+        results = [run_task(task, engine) for task in tasks]
+    return {'engine': engine, 'tasks': {result['task']: result for result in results}}
+
+def compare(baseline, current, threshold=DEFAULT_THRESHOLD):
+    # A task regresses when it fails cases, takes more than `threshold`
+    # longer than in the baseline, or changes its step count (which means
+    # the interpreter's behaviour changed, not just its speed).
+    rows = []
+    for name, result in sorted(current['tasks'].items()):
+        before = baseline['tasks'].get(name)
+        ratio = result['seconds'] / before['seconds'] if before and before['seconds'] else None
+        problems = []
+        if result['failures']:
+            problems.append('%d failing cases' % len(result['failures']))
+        if before is not None and result['steps'] != before['steps']:
+            problems.append('steps %d -> %d' % (before['steps'], result['steps']))
+        if ratio is not None and ratio > 1 + threshold:
+            problems.append('%.2fx slower' % ratio)
+        rows.append((name, before, result, ratio, problems))
+    return rows
+
+def format_results(results):
+    lines = ['%-8s %6s %9s %10s %12s %10s %10s %6s' % (
+        'task', 'cases', 'failures', 'steps', 'steps/sec', 'p50 ms', 'p99 ms', 'peak')]
+    for name, result in sorted(results['tasks'].items()):
+        lines.append('%-8s %6d %9d %10d %12.0f %10.3f %10.3f %6d' % (
+            name, result['cases'], len(result['failures']), result['steps'],
+            result['steps_per_sec'], result['p50'] * 1000, result['p99'] * 1000,
+            result['peak_length']))
+    return '\n'.join(lines)
+
+def format_comparison(rows):
+    lines = ['%-8s %10s %10s %7s  %s' % ('task', 'base s', 'now s', 'ratio', 'problems')]
+    for name, before, result, ratio, problems in rows:
+        lines.append('%-8s %10s %10.4f %7s  %s' % (
+            name, '%.4f' % before['seconds'] if before else '-', result['seconds'],
+            '%.2f' % ratio if ratio is not None else '-', ', '.join(problems)))
+    return '\n'.join(lines)
+
+if __name__ == '__main__':
+    argparser = argparse.ArgumentParser(
+        description='Run every bundled solution over testcase_full.jsonl and record timings')
+    argparser.add_argument('--engine', choices=sorted(A2B.ENGINES), default=A2B.DEFAULT_ENGINE)
+    argparser.add_argument('--jobs', type=int, default=1)
+    argparser.add_argument('--task', dest='tasks', action='append',
+                           help='only run the named task (repeatable)')
+    argparser.add_argument('--write-baseline', metavar='PATH',
+                           help='save the results as a JSON baseline')
+    argparser.add_argument('--baseline', metavar='PATH',
+                           help='compare the results against a saved baseline')
+    argparser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                           help='allowed slowdown per task before it counts as a regression')
+    args = argparser.parse_args()
+
+    results = run(discover(names=args.tasks), args.engine, args.jobs)
+    print(format_results(results))
+    failed = any(result['failures'] for result in results['tasks'].values())
+
+    if args.write_baseline:
+        with open(args.write_baseline, 'w', encoding='utf-8') as baseline_file:
+            json.dump(results, baseline_file, indent=2, sort_keys=True)
+            baseline_file.write('\n')
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as baseline_file:
+            baseline = json.load(baseline_file)
+        rows = compare(baseline, results, args.threshold)
+        print()
+        print(format_comparison(rows))
+        failed = failed or any(problems for _, _, _, _, problems in rows)
+
+    sys.exit(1 if failed else 0)
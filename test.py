@@ -1,16 +1,41 @@
 #!/usr/bin/env python3
 
+import itertools
+import json
+import subprocess
 import sys
 import unittest
-from io import StringIO
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from io import BytesIO, StringIO
+from pathlib import Path
 
 import A2B
+import regression
 from A2B import A2BExecutionException, A2BParseException, execute, parse
 
 def rules(*lines):
     return "\n".join(lines)
 
 
+def traced(program, value, engine):
+    stderr = StringIO()
+    original_stderr = sys.stderr
+    try:
+        sys.stderr = stderr
+        output = execute(program, value, verbose=True, engine=engine)
+    finally:
+        sys.stderr = original_stderr
+    return output, stderr.getvalue()
+
+
+def bundled_cases():
+    for task in sorted(Path(__file__).parent.glob("tasks/*/solution.a2b")):
+        source = task.read_text(encoding="utf-8")
+        with open(task.parent / "testcase_pretest.jsonl", encoding="utf-8") as cases:
+            yield task.parent.name, source, [json.loads(line) for line in cases]
+
+
 class ExecutionModelTests(unittest.TestCase):
     def test_empty_program_is_identity(self):
         program = parse("")
@@ -198,27 +223,561 @@ class RepresentativeProgramTests(unittest.TestCase):
             self.assertEqual(value[::-1], execute(program, value))
 
 
+class EngineTests(unittest.TestCase):
+    PROGRAMS = (
+        (rules("a=b", "ba=x"), ("aa", "abab", "")),
+        (rules("ab=X", "X=(return)done"), ("abab", "ba")),
+        (rules("(once)a=aa", "a=b"), ("a", "aaa")),
+        (rules("(once)aa=x", "b=a"), ("ba", "bba")),
+        ("(once)=(start)X\nXa=aX\nX=", ("", "aaab")),
+        ("(once)=(end)X", ("ab",)),
+        (rules("(start)a=X", "(end)b=Y", "ab=(end)c"), ("abab", "ba", "b")),
+        (rules("(end)c=(start)X", "ca=(start)", "=(return)ok"), ("abc", "cab")),
+        (rules("ba=ab", "ca=ac", "cb=bc"), ("ccaacbaaaa", "cbacba")),
+        (rules("abc=1", "bc=2", "c=3", "b=4"), ("abcbcc", "cbabc")),
+    )
+
+    def assert_engines_agree(self, source, values):
+        program = parse(source)
+        for value in values:
+            expected = traced(program, value, "scan")
+            for engine in A2B.ENGINES:
+                with self.subTest(source=source, value=value, engine=engine):
+                    self.assertEqual(expected, traced(program, value, engine))
+
+    def test_engines_reproduce_reference_traces(self):
+        for source, values in self.PROGRAMS:
+            self.assert_engines_agree(source, values)
+
+    def test_engines_agree_on_bundled_tasks(self):
+        for name, source, cases in bundled_cases():
+            program = parse(source)
+            for engine in A2B.ENGINES:
+                for case in cases:
+                    with self.subTest(task=name, engine=engine, input=case["input"]):
+                        self.assertEqual(
+                            case["output"],
+                            execute(program, case["input"], engine=engine),
+                        )
+
+    def test_incremental_index_agrees_with_scanning(self):
+        original = A2B.INCREMENTAL_MIN_LENGTH
+        try:
+            for minimum in (0, 4):
+                A2B.INCREMENTAL_MIN_LENGTH = minimum
+                for source, values in self.PROGRAMS:
+                    program = parse(source)
+                    for value in values:
+                        with self.subTest(source=source, value=value, minimum=minimum):
+                            self.assertEqual(
+                                traced(program, value, "scan"),
+                                traced(program, value, "incremental"),
+                            )
+        finally:
+            A2B.INCREMENTAL_MIN_LENGTH = original
+
+    def test_automaton_and_find_searches_agree_with_scanning(self):
+        original = A2B.AUTOMATON_CHARACTER_COST
+        try:
+            for cost in (0, 10**9):
+                A2B.AUTOMATON_CHARACTER_COST = cost
+                for source, values in self.PROGRAMS:
+                    program = parse(source)
+                    for value in values:
+                        with self.subTest(source=source, value=value, cost=cost):
+                            self.assertEqual(
+                                traced(program, value, "scan"),
+                                traced(program, value, "automaton"),
+                            )
+        finally:
+            A2B.AUTOMATON_CHARACTER_COST = original
+
+    def test_generated_python_is_shared_by_identical_programs(self):
+        first, second = parse(rules("(once)a=b", "ab=(end)c")), parse(rules("(once)a=b", "ab=(end)c"))
+        generated = first.compile("python", A2B.compile_python)
+        self.assertIs(generated, second.compile("python", A2B.compile_python))
+        self.assertIn("line.find('ab')", generated.source)
+        self.assertEqual(("bc", 2, None), generated.run("aab", 10, 10))
+        self.assertEqual((None, 2, A2B.LIMIT_STEPS), generated.run("aab", 1, 10))
+        self.assertEqual((None, 0, A2B.LIMIT_LENGTH), generated.run("aab", 10, 2))
+
+    def test_unknown_engine_is_rejected(self):
+        with self.assertRaises(ValueError):
+            execute(parse("a=b"), "a", engine="missing")
+
+    def test_gap_buffer_tracks_splices_and_finds_across_the_gap(self):
+        buffer = A2B.GapBuffer(b"abcabc")
+        text = "abcabc"
+        for start, end, insert in ((1, 2, "XY"), (0, 0, "ab"), (9, 9, "cab"),
+                                   (3, 7, ""), (2, 2, "ca"), (0, 4, "")):
+            buffer.splice(start, end, insert.encode("ascii"))
+            text = text[:start] + insert + text[end:]
+            self.assertEqual(text, str(buffer))
+            self.assertEqual(len(text), len(buffer))
+            for pattern in ("", "a", "ab", "bc", "cab", "Yc", "zz", text):
+                encoded = pattern.encode("ascii")
+                self.assertEqual(text.find(pattern), buffer.find(encoded))
+                self.assertEqual(text.startswith(pattern), buffer.startswith(encoded))
+                self.assertEqual(text.endswith(pattern), buffer.endswith(encoded))
+
+    def test_enablement_graph_tracks_overlaps_and_joins(self):
+        program = parse(rules("ab=c", "c=a", "(start)x=", "b=(end)a"))
+        self.assertEqual([{1}, {0}, {0, 2}, {0, 2}], A2B.enabled_rules(program))
+
+    def test_scan_engine_skips_rules_known_not_to_match(self):
+        program = parse(rules("x=y", "a=b", "b=c"))
+        state = A2B.start_engine(program, "aab")
+        self.assertIs(program.exprs[1], state.step())
+        self.assertEqual(0b001, state.dead)
+        self.assertIs(program.exprs[1], state.step())
+        self.assertIs(program.exprs[2], state.step())
+        self.assertEqual(0b011, state.dead)
+
+    def test_scan_engine_blocks_rules_needing_an_absent_character(self):
+        program = parse(rules("(once)=(start)X", "Xa=aX", "X=", "b=c"))
+        state = A2B.start_engine(program, "aa")
+        self.assertEqual((0b1110, {"X": 0, "a": 2, "b": 0}), (state.blocked, state.counts))
+        state.step()
+        self.assertEqual(0b1000, state.blocked)
+        for _ in range(3):
+            state.step()
+        self.assertEqual(("aa", 0b1110), (state.value(), state.blocked))
+
+    def test_compiled_rules_agree_with_execute(self):
+        sides = ("", "a", "ab", "(start)", "(start)a", "(end)", "(end)ba")
+        for left in sides + ("(once)", "(once)b"):
+            for right in sides + ("(return)", "(return)x"):
+                expr = parse(left + "=" + right).exprs[0]
+                rule = A2B.CompiledRule(0, expr)
+                for line in ("", "a", "ab", "bab", "xaby", "ba"):
+                    with self.subTest(rule=expr.plain_text, line=line):
+                        executed, output = expr.Execute(line, A2B.ExecutionContext())
+                        expected = None if executed == A2B.EXECUTED_PASS else output
+                        self.assertEqual(expected, rule.apply(line))
+
+    def test_once_rule_executes_once_per_context(self):
+        expr = parse("(once)a=b").exprs[0]
+        context = A2B.ExecutionContext()
+        self.assertEqual((A2B.EXECUTED_DONE, "ba"), expr.Execute("aa", context, 0))
+        self.assertEqual((A2B.EXECUTED_PASS, ""), expr.Execute("ba", context, 0))
+        self.assertEqual(0b1, context.once)
+        with self.assertRaises(ValueError):
+            expr.Execute("ba")
+
+    def test_bulk_rules_require_no_enabled_rule_above(self):
+        program = parse(rules("e=", "ab=x", "b=a", "c=d", "a=ba", "(start)f=g", "g="))
+        self.assertEqual([True, True, False, True, False, False, False],
+                         A2B.bulk_rules(program))
+
+    def test_bulk_engine_stops_at_the_exact_limit(self):
+        program = parse("a=bb")
+        state = A2B.start_engine(program, "a" * 10, "bulk")
+        self.assertIsNotNone(state.step())
+        self.assertEqual((10, "b" * 20), (state.count, state.value()))
+        state = A2B.start_engine(program, "a" * 10, "bulk", A2B.ExecutionContext(max_steps=3))
+        state.step()
+        self.assertEqual(4, state.count)
+        state = A2B.start_engine(program, "a" * 10, "bulk", A2B.ExecutionContext(max_length=12))
+        state.step()
+        self.assertEqual((3, 13), (state.count, len(state)))
+
+    def test_superoperators_run_idioms_with_exact_step_counts(self):
+        for source, value, counts, output in (
+                ("cb=bc\nca=ac\nba=ab", "cbacab", [8], "aabbcc"),
+                ("(once)=(start)X\nXa=bX\nXb=aX\nX=", "abab", [1, 4, 1], "baba"),
+                ("(once)=(end)XXX\naX=(end)a\nbX=(end)b\nX=", "aab", [1, 3], "baa")):
+            with self.subTest(source=source):
+                program = parse(source)
+                state = A2B.start_engine(program, value, "bulk")
+                seen = []
+                while state.step() is not None:
+                    seen.append(state.count)
+                self.assertEqual((counts, output), (seen, state.value()))
+                context = A2B.ExecutionContext(A2B.EXECUTOR_OPERATION_LIMIT, A2B.LINE_LENGTH_LIMIT)
+                execute(program, value, context=context)
+                self.assertEqual(sum(counts), context.steps)
+
+    def test_superoperators_report_the_peak_length_they_pass(self):
+        # The sweep grows the string to 19 characters and then shrinks it.
+        program = parse("(once)=(start)X\nXa=bbX\nXb=X\nX=")
+        peaks = []
+        for engine in ("scan", "bulk"):
+            context = A2B.ExecutionContext(A2B.EXECUTOR_OPERATION_LIMIT, A2B.LINE_LENGTH_LIMIT)
+            execute(program, "aaaabbbbbbbbbb", engine=engine, context=context)
+            peaks.append((context.steps, context.peak_length))
+        self.assertEqual([(16, 19)] * 2, peaks)
+
+    def test_idiom_overrunning_the_step_limit_is_not_retried(self):
+        program = parse("(once)=(start)X\nXa=bX\nXb=aX\nX=")
+        state = A2B.start_engine(program, "ab" * 50, "bulk", A2B.ExecutionContext(max_steps=20))
+        state.step()
+        state.step()
+        idiom = state.stalled
+        self.assertIsInstance(idiom, A2B.SweepIdiom)
+        for _ in range(10):
+            self.assertEqual(1, state.count)
+            state.step()
+        self.assertIs(idiom, state.stalled)
+        self.assertEqual("ba" * 5 + "bXb" + "ab" * 44, state.value())
+
+    def test_superoperators_need_rules_above_to_stay_disabled(self):
+        self.assertEqual([None, None], A2B.superoperators(parse("aa=b\nXa=aX")))
+        self.assertEqual((None, []), A2B.sort_idiom(parse("ba=ab\nab=ba")))
+        idioms = A2B.superoperators(parse("x=y\nXa=aX"))
+        self.assertEqual([(0, "x=y")], [(index, expr.plain_text) for index, expr in idioms[1].guard])
+
+    def test_marker_machines_compile_to_transducers(self):
+        machine = A2B.transducer(parse(rules("(once)=(start)X", "Xa=bY", "Yb=X", "Xb=",
+                                             "(end)Y=(return)odd", "(end)X=(start)Z")))
+        self.assertEqual(("X", {"X", "Y"}), (machine.start, set(machine.markers)))
+        self.assertEqual({("X", "a"): ("b", "Y"), ("Y", "b"): ("", "X"), ("X", "b"): ("", None)},
+                         machine.transitions)
+        self.assertEqual(("odd", 3, None), machine.run("a", 100, 100))
+        self.assertEqual(("Zbb", 6, None), machine.run("abab", 100, 100))
+        self.assertEqual((None, 3, A2B.LIMIT_STEPS), machine.run("abab", 2, 100))
+        self.assertIsNone(machine.run("aX", 100, 100))
+        for source in ("(once)=(start)X\nXa=bXc", "(once)=(start)X\n(start)Xa=X", "Xa=X"):
+            self.assertIsNone(A2B.transducer(parse(source)), source)
+
+    def test_automaton_shares_overlapping_patterns(self):
+        matcher = A2B.MultiPatternMatcher(["he", "she", "his", "hers"])
+        program = parse(rules("hers=1", "his=2", "she=3", "he=4"))
+        self.assertEqual(4, len(matcher.lengths))
+        self.assertEqual(
+            execute(program, "ushershis"),
+            execute(program, "ushershis", engine="automaton"),
+        )
+
+
+class OptimizerTests(unittest.TestCase):
+    def test_shadowed_and_unreachable_rules_are_removed(self):
+        program = parse(rules("ab=x", "cabd=y", "(start)q=z", "(start)qr=w", "e=f",
+                              "(once)f=g", "h=i", "(once)=(end)c"))
+        optimized, removed = A2B.optimize(program, "abcdq")
+        self.assertEqual(["ab=x", "(start)q=z", "(once)=(end)c"],
+                         [expr.plain_text for expr in optimized.exprs])
+        self.assertEqual([("cabd=y", "shadowed by line 1"), ("(start)qr=w", "shadowed by line 3"),
+                          ("e=f", "needs unreachable 'e'"), ("(once)f=g", "needs unreachable 'f'"),
+                          ("h=i", "needs unreachable 'h'")],
+                         [(expr.plain_text, reason) for expr, reason in removed])
+        self.assertEqual(["ab=x", "(start)q=z"],
+                         [expr.plain_text for expr in A2B.optimize(parse("ab=x\n(start)q=z"))[0].exprs])
+
+    def test_optimized_bundled_tasks_run_the_same_steps(self):
+        for name, source, cases in bundled_cases():
+            program = parse(source)
+            alphabet = set("".join(case["input"] for case in cases))
+            optimized, _ = A2B.optimize(program, alphabet)
+            for case in cases:
+                with self.subTest(task=name, input=case["input"]):
+                    before, after = (A2B.ExecutionContext(A2B.EXECUTOR_OPERATION_LIMIT,
+                                                          A2B.LINE_LENGTH_LIMIT)
+                                     for _ in range(2))
+                    self.assertEqual(execute(program, case["input"], context=before),
+                                     execute(optimized, case["input"], context=after))
+                    self.assertEqual(before.steps, after.steps)
+
+    def test_fired_once_rules_leave_the_scan_list(self):
+        program = parse(rules("(once)a=b", "(once)b=c", "c=d"))
+        state = A2B.start_engine(program, "a")
+        state.step()
+        self.assertEqual([1, 2], [rule.index for rule in state.active])
+        state.step()
+        self.assertEqual([2], [rule.index for rule in state.active])
+
+    def test_exclusive_marker_rules_are_reordered_by_hits(self):
+        # A parity machine: one state marker walks the input, so its rules
+        # never match together, while "ab=ba" can and stays in place.
+        program = parse(rules("(once)=(start)E", "Ea=O", "Eb=E", "Oa=E", "Ob=O",
+                              "(end)E=(return)even", "(end)O=(return)odd", "ab=ba"))
+        self.assertEqual([frozenset("EO")], A2B.marker_classes(program, "ab"))
+        self.assertEqual([], A2B.marker_classes(parse("(once)=X\n(once)=X"), "ab"))
+        profile = A2B.Profile(program)
+        for value in ("abba", "bbbab", "ab"):
+            execute(program, value, profile=profile)
+        reordered, obligations = A2B.reorder(program, profile.hits, "ab")
+        self.assertEqual([3, 3, 3, 1, 4, 1, 2, 0], profile.hits)
+        self.assertEqual(["(once)=(start)E", "Ob=O", "Ea=O", "Eb=E", "(end)O=(return)odd",
+                          "Oa=E", "(end)E=(return)even", "ab=ba"],
+                         [expr.plain_text for expr in reordered.exprs])
+        self.assertEqual([((4, 1, 2, 6, 3, 5), frozenset("EO"))], obligations)
+        self.assertTrue(A2B.check_reordering(program, reordered, obligations, "ab"))
+        for value in ("", "a", "abba", "bbbab", "aab"):
+            self.assertEqual(execute(program, value), execute(reordered, value))
+        self.assertFalse(A2B.check_reordering(program, reordered, obligations, "abE"))
+        self.assertFalse(A2B.check_reordering(
+            program, reordered, [((7, 6), frozenset("EO"))] + obligations, "ab"))
+        self.assertFalse(A2B.check_reordering(program, program, obligations, "ab"))
+        self.assertIsNone(A2B.overlap_witness(program.exprs[1], program.exprs[4], "EO"))
+        overlapping = parse(rules("Ea=x", "ab=y"))
+        self.assertEqual("abEa", A2B.overlap_witness(*overlapping.exprs, "E"))
+        self.assertFalse(A2B.check_reordering(
+            overlapping, A2B.Program(overlapping.exprs[::-1]), [((1, 0), frozenset("E"))], "ab"))
+        unproved, obligations = A2B.reorder(program, profile.hits, "abEO")
+        self.assertEqual((program.exprs, []), (unproved.exprs, obligations))
+
+    def test_reordering_needs_a_single_marker_class(self):
+        # "xxx=E" can write any number of E, so both swapped rules can match
+        # "ExxEb" and the swap turns "xxxaxxxb" from B into A.
+        program = parse(rules("xxx=E", "Eb=(return)B", "Ea=(return)A"))
+        reordered = A2B.Program([program.exprs[0], program.exprs[2], program.exprs[1]])
+        self.assertEqual([], A2B.marker_classes(program, "abx"))
+        self.assertEqual(("B", "A"), (execute(program, "xxxaxxxb"), execute(reordered, "xxxaxxxb")))
+        self.assertFalse(A2B.check_reordering(
+            program, reordered, [((2, 1), frozenset("E"))], "abx"))
+        self.assertEqual(float('inf'), A2B.marker_count_bound(program, "E"))
+        self.assertEqual(2, A2B.marker_count_bound(parse("(once)=X\n(once)=X"), "X"))
+
+    def test_reordered_bundled_tasks_run_the_same_steps(self):
+        for name, source, cases in bundled_cases():
+            program = parse(source)
+            alphabet = set("".join(case["input"] for case in cases))
+            profile = A2B.Profile(program)
+            for case in cases:
+                execute(program, case["input"], profile=profile)
+            reordered, obligations = A2B.reorder(program, profile.hits, alphabet)
+            self.assertTrue(A2B.check_reordering(program, reordered, obligations, alphabet))
+            for case in cases:
+                with self.subTest(task=name, input=case["input"]):
+                    before, after = (A2B.ExecutionContext(A2B.EXECUTOR_OPERATION_LIMIT,
+                                                          A2B.LINE_LENGTH_LIMIT)
+                                     for _ in range(2))
+                    self.assertEqual(execute(program, case["input"], context=before),
+                                     execute(reordered, case["input"], context=after))
+                    self.assertEqual(before.steps, after.steps)
+
+
+class ProfileTests(unittest.TestCase):
+    def test_profile_counts_hits_attempts_and_copies(self):
+        program = parse(rules("c=x", "ab=ba", "a=", "b=cc"))
+        profile = A2B.Profile(program)
+        self.assertEqual(execute(program, "aab"), execute(program, "aab", profile=profile))
+        self.assertEqual([2, 2, 2, 1], profile.hits)
+        self.assertEqual([2, 4, 2, 1], profile.attempts)
+        self.assertEqual(7, profile.steps)
+        self.assertEqual(3, profile.peak_length)
+        self.assertEqual([4, 6, 3, 2], profile.copied)
+        self.assertIn("peak length: 3", profile.format_table())
+        summary = profile.as_dict()
+        self.assertEqual(sum(profile.copied), summary["copied"])
+        self.assertEqual(sorted(row["line"] for row in summary["rules"]), [1, 2, 3, 4])
+        self.assertEqual(summary, json.loads(json.dumps(summary)))
+
+    def test_profile_skips_the_checks_a_plain_scan_skips(self):
+        program = parse(rules("Xa=b", "Yb=c", "a=d"))
+        profile = A2B.Profile(program)
+        self.assertEqual("dddd", execute(program, "aaaa", profile=profile))
+        self.assertEqual([0, 0, 4], profile.attempts)
+
+
+class TraceRecorderTests(unittest.TestCase):
+    SOURCE = rules("(once)=(start)X", "Xa=bX", "Xb=aX", "X=")
+
+    def test_replay_rebuilds_every_step_from_checkpoints(self):
+        program = parse(self.SOURCE)
+        line = "abbab"
+        _, text = traced(program, line, "scan")
+        states = [line] + [step.split("<< ")[1].split("\n")[0]
+                           for step in text.split("Step ")[1:]]
+        for checkpoint_every in (1, 3, 1024):
+            recorder = A2B.TraceRecorder(program, line, checkpoint_every=checkpoint_every)
+            execute(program, line, trace=recorder)
+            self.assertEqual(len(states) - 1, recorder.steps)
+            self.assertEqual(states, [recorder.value_at(step) for step in range(len(states))])
+            self.assertEqual((1, 0), (recorder.rules[1], recorder.positions[1]))
+
+    def test_sampling_and_streaming_round_trip(self):
+        program = parse(self.SOURCE)
+        line = "ab" * 20
+        recorder = A2B.TraceRecorder(program, line, sample=4)
+        execute(program, line, trace=recorder)
+        self.assertEqual([1, 5, 9], [entry["step"] for entry in recorder][:3])
+        self.assertEqual(set(recorder.deltas[1:]), {4})
+
+        stream = BytesIO()
+        streamed = A2B.TraceRecorder(program, line, sample=4, checkpoint_every=8, stream=stream)
+        streamed.flush_records = 3
+        execute(program, line, trace=streamed)
+        streamed.close()
+        stream.seek(0)
+        loaded = A2B.TraceRecorder.load(program, stream)
+        self.assertEqual(list(recorder), list(loaded))
+        self.assertEqual(recorder.value_at(recorder.steps), loaded.value_at(loaded.steps))
+
+
+class BatchModeTests(unittest.TestCase):
+    def test_batch_input_formats(self):
+        self.assertEqual([("ab", "bb"), ("", None)],
+                         A2B.read_batch('{"input": "ab", "output": "bb"}\n\n{"input": ""}\n'))
+        self.assertEqual([("ab", None), ("", None), ("c", None)], A2B.read_batch("ab\n\nc\n"))
+        self.assertEqual([("{ab", None), ("{}", None)], A2B.read_batch("{ab\n{}\n"))
+        for text, line_no in (('{"input": "ab", "output": "bb"}\n{"inptu": "a"}\n', 2),
+                              ('{"input": "ab"}\n\n{"input": "a"\n', 3)):
+            with self.assertRaisesRegex(ValueError, "Line %d " % line_no):
+                A2B.read_batch(text)
+
+    def test_batch_results_keep_input_order_across_jobs(self):
+        program = parse(rules("ba=ab", "aa=(return)x", "c=cc"))
+        cases = [(value, None) for value in ("ba", "bbaa", "", "c", "ab")]
+        def strip(results):
+            return [{key: value for key, value in result.items() if key != "elapsed"}
+                    for result in results]
+        sequential = A2B.run_batch(program, cases)
+        self.assertEqual(strip(sequential), strip(A2B.run_batch(program, cases, jobs=2)))
+        self.assertEqual({"output": "ab", "steps": 1, "status": "ok"}, strip(sequential)[0])
+        self.assertEqual("String Length Limit Exceeded", sequential[3]["status"])
+        self.assertEqual(A2B.LINE_LENGTH_LIMIT, sequential[3]["steps"])
+
+    def test_cli_batch_mode_grades_a_testcase_file(self):
+        task = Path(__file__).parent / "tasks" / "1-1"
+        completed = subprocess.run(
+            [sys.executable, str(Path(__file__).parent / "A2B.py"), "--batch",
+             str(task / "testcase_pretest.jsonl"), "--jobs", "2", str(task / "solution.a2b")],
+            capture_output=True, text=True, check=True)
+        results = [json.loads(line) for line in completed.stdout.splitlines()]
+        with open(task / "testcase_pretest.jsonl", encoding="utf-8") as cases:
+            self.assertEqual(sum(1 for _ in cases), len(results))
+        self.assertTrue(all(result["passed"] for result in results))
+
+    def test_cli_batch_mode_fails_when_a_case_fails(self):
+        task = Path(__file__).parent / "tasks" / "1-1"
+        completed = subprocess.run(
+            [sys.executable, str(Path(__file__).parent / "A2B.py"), "--batch", "-",
+             str(task / "solution.a2b")],
+            input='{"input": "a", "output": "not this"}\n', capture_output=True, text=True)
+        self.assertEqual(1, completed.returncode)
+        self.assertFalse(json.loads(completed.stdout)["passed"])
+
+
+class RegressionRunnerTests(unittest.TestCase):
+    def test_task_metrics_and_baseline_comparison(self):
+        tasks = regression.discover(names=["1-1", "1-2"])
+        self.assertEqual(["1-1", "1-2"], [task.name for task in tasks])
+        results = regression.run(tasks)
+        for result in results["tasks"].values():
+            self.assertEqual([], result["failures"])
+            self.assertGreater(result["steps"], 0)
+            self.assertLessEqual(result["p50"], result["p99"])
+        self.assertEqual(results, json.loads(json.dumps(results)))
+
+        baseline = json.loads(json.dumps(results))
+        baseline["tasks"]["1-1"]["seconds"] = results["tasks"]["1-1"]["seconds"] / 2
+        baseline["tasks"]["1-2"]["steps"] += 1
+        problems = {name: problems for name, _, _, _, problems
+                    in regression.compare(baseline, results, threshold=0.5)}
+        self.assertEqual(["2.00x slower"], problems["1-1"])
+        self.assertEqual(1, len(problems["1-2"]))
+        self.assertTrue(problems["1-2"][0].startswith("steps"))
+        self.assertEqual([], regression.compare(results, results)[0][4])
+
+    def test_percentile_uses_nearest_rank(self):
+        values = list(range(1, 101))
+        self.assertEqual((50, 99, 100), (regression.percentile(values, 0.5),
+                                         regression.percentile(values, 0.99),
+                                         regression.percentile(values, 1.0)))
+
+
 class InterpreterLimitTests(unittest.TestCase):
-    def test_operation_limit_stops_nonterminating_program(self):
-        old_limit = A2B.EXECUTOR_OPERATION_LIMIT
-        A2B.EXECUTOR_OPERATION_LIMIT = 3
+    def test_module_limits_are_the_defaults(self):
+        old_limits = A2B.EXECUTOR_OPERATION_LIMIT, A2B.LINE_LENGTH_LIMIT
+        A2B.EXECUTOR_OPERATION_LIMIT, A2B.LINE_LENGTH_LIMIT = 3, 3
         try:
             with self.assertRaises(A2BExecutionException) as raised:
                 execute(parse("a=a"), "a")
             self.assertIn("Time Limit Exceeded", str(raised.exception))
-        finally:
-            A2B.EXECUTOR_OPERATION_LIMIT = old_limit
-
-    def test_string_length_limit_checks_input_and_generated_state(self):
-        old_limit = A2B.LINE_LENGTH_LIMIT
-        A2B.LINE_LENGTH_LIMIT = 3
-        try:
             with self.assertRaises(A2BExecutionException):
                 execute(parse(""), "abcd")
             with self.assertRaises(A2BExecutionException):
                 execute(parse("a=aaaa"), "a")
         finally:
-            A2B.LINE_LENGTH_LIMIT = old_limit
+            A2B.EXECUTOR_OPERATION_LIMIT, A2B.LINE_LENGTH_LIMIT = old_limits
+
+    def test_operation_limit_stops_nonterminating_program(self):
+        with self.assertRaises(A2BExecutionException) as raised:
+            execute(parse("a=a"), "a", max_steps=3)
+        self.assertIn("Time Limit Exceeded", str(raised.exception))
+
+    def test_cycle_detection_reports_exact_cycle_length(self):
+        for source, line, length in (("a=a", "a", 1), ("ab=ba\nba=ab", "ab", 2),
+                                     ("(once)=x\nxa=ax\nax=xa", "a", 2)):
+            with self.subTest(source=source):
+                with self.assertRaises(A2BExecutionException) as raised:
+                    execute(parse(source), line, detect_cycles=True)
+                self.assertIn("Cycle Length %d" % length, str(raised.exception))
+        self.assertEqual(execute(parse("ab=ba"), "abab", detect_cycles=True), "bbaa")
+
+    def test_string_length_limit_checks_input_and_generated_state(self):
+        with self.assertRaises(A2BExecutionException):
+            execute(parse(""), "abcd", max_length=3)
+        with self.assertRaises(A2BExecutionException):
+            execute(parse("a=aaaa"), "a", max_length=3)
+
+    def test_work_budget_charges_scanned_and_copied_characters(self):
+        # aaa -> baa -> bba -> bbb costs 3 * (3 + 3); bbb -> ccbb -> ccccb
+        # -> cccccc costs (3 + 4) + (4 + 5) + (5 + 6).
+        program = parse("a=b\nb=cc")
+        for engine in ("scan", "bulk"):
+            with self.subTest(engine=engine):
+                context = A2B.ExecutionContext(100, 100, max_work=45)
+                self.assertEqual(execute(program, "aaa", engine=engine, context=context),
+                                 "cccccc")
+                self.assertEqual((context.steps, context.work), (6, 45))
+                with self.assertRaises(A2BExecutionException) as raised:
+                    execute(program, "aaa", engine=engine, max_work=44)
+                self.assertIn("Work Limit Exceeded", str(raised.exception))
+
+    def test_context_limits_may_be_unlimited_but_not_doubled(self):
+        context = A2B.ExecutionContext(max_steps=5)
+        self.assertEqual("b" * 5, execute(parse("a=b"), "a" * 5, context=context))
+        self.assertEqual("b" * 2000, execute(parse("a=b"), "a" * 2000,
+                                             context=A2B.ExecutionContext()))
+        with self.assertRaises(A2BExecutionException):
+            execute(parse("a=b"), "a" * 50, context=A2B.ExecutionContext(max_steps=5))
+        with self.assertRaises(ValueError):
+            execute(parse("a=b"), "a", max_steps=5, context=A2B.ExecutionContext())
+
+    def test_timeout_stops_a_long_run(self):
+        with self.assertRaises(A2BExecutionException) as raised:
+            execute(parse("a=a"), "a", max_steps=10**9, timeout=0)
+        self.assertIn("Deadline Exceeded", str(raised.exception))
+
+    def test_interpret_returns_the_limit_and_feeds_observers(self):
+        class Steps(list):
+            def record(self, expr, before, state, context):
+                self.append((context.steps, before, state.value()))
+
+        program = parse("a=b\nb=cc")
+        observer = Steps()
+        context = A2B.ExecutionContext(100, 100)
+        self.assertEqual((None, "cccccc", None),
+                         A2B.interpret(program, "aaa", context, "bulk", observers=(observer,)))
+        self.assertEqual([(1, "aaa", "baa"), (6, "ccccb", "cccccc")], observer[::5])
+        self.assertEqual(6, context.peak_length)
+        for source, context, expected in (
+                ("a=a", A2B.ExecutionContext(3, 10), (A2B.LIMIT_STEPS, None, None)),
+                ("a=aa", A2B.ExecutionContext(10, 3), (A2B.LIMIT_LENGTH, None, None)),
+                ("a=b", A2B.ExecutionContext(10, 10, max_work=5), (A2B.LIMIT_WORK, None, None))):
+            with self.subTest(source=source):
+                self.assertEqual(expected, A2B.interpret(parse(source), "aaa", context))
+        self.assertEqual((A2B.LIMIT_CYCLE, None, 2),
+                         A2B.interpret(parse("ab=ba\nba=ab"), "ab", A2B.ExecutionContext(),
+                                       detect_cycles=True))
+        seen = []
+        def stop_at_c(state, context):
+            seen.append((context.steps, state.value()))
+            return "c" in state.value()
+        context = A2B.ExecutionContext(100, 100)
+        self.assertEqual((A2B.LIMIT_STOPPED, None, None),
+                         A2B.interpret(program, "ab", context, before_step=stop_at_c))
+        self.assertEqual([(0, "ab"), (1, "bb"), (2, "ccb")], seen)
+
+    def test_one_program_runs_concurrently_in_threads(self):
+        program = parse(rules("(once)a=X", "(once)b=Y", "ab=ba", "X=x", "Y=y"))
+        values = ["".join(chars) for chars in itertools.product("ab", repeat=6)]
+        expected = [execute(program, value) for value in values]
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            for _ in range(3):
+                self.assertEqual(expected, list(pool.map(partial(execute, program), values)))
 
 
 if __name__ == "__main__":
@@ -2,43 +2,44 @@
 
 import random
 
-from A2B import EXECUTED_DONE, EXECUTED_NONE, EXECUTED_RETURN, parse
+from A2B import LIMIT_LENGTH, LIMIT_STEPS, ExecutionContext, TraceRecorder, interpret
 
 from .dataset import execute_with_limits
+from .programs import parse_program
 
 
-def bounded_trace(source, input_value, *, step_limit, length_limit):
-    program = parse(source)
-    for expression in program.exprs:
-        expression.executed = 0
-    value = input_value
-    trace = []
-    if len(value) > length_limit:
+class _StepList(list):
+    """Trace observer that keeps every step as a dict with both strings."""
+
+    def record(self, expression, before, state, context):
+        self.append(
+            {
+                "step": context.steps,
+                "rule_line": expression.line_no + 1,
+                "rule": expression.plain_text,
+                "before": before,
+                "after": state.value(),
+            }
+        )
+
+
+TRACE_STATUSES = {None: "halted", LIMIT_STEPS: "step_limit", LIMIT_LENGTH: "length_limit"}
+
+
+def bounded_trace(source, input_value, *, step_limit, length_limit, compact=False):
+    """Run ``source`` step by step and return its status, output and trace.
+
+    With ``compact`` the trace is a ``TraceRecorder``: it yields the same step
+    dicts, but rebuilds ``before``/``after`` on demand instead of storing a
+    copy of the working string per step.
+    """
+    program = parse_program(source)
+    trace = TraceRecorder(program, input_value) if compact else _StepList()
+    if len(input_value) > length_limit:
         return {"status": "length_limit", "output": None, "trace": trace}
-    while True:
-        executed = EXECUTED_NONE
-        for expression in program.exprs:
-            executed, output = expression.Execute(value)
-            if executed in (EXECUTED_DONE, EXECUTED_RETURN):
-                trace.append(
-                    {
-                        "step": len(trace) + 1,
-                        "rule_line": expression.line_no + 1,
-                        "rule": expression.plain_text,
-                        "before": value,
-                        "after": output,
-                    }
-                )
-                value = output
-                break
-        else:
-            return {"status": "halted", "output": value, "trace": trace}
-        if len(trace) > step_limit:
-            return {"status": "step_limit", "output": None, "trace": trace}
-        if len(value) > length_limit:
-            return {"status": "length_limit", "output": None, "trace": trace}
-        if executed == EXECUTED_RETURN:
-            return {"status": "halted", "output": value, "trace": trace}
+    context = ExecutionContext(step_limit, length_limit)
+    limit, output, _ = interpret(program, input_value, context, observers=(trace,))
+    return {"status": TRACE_STATUSES[limit], "output": output, "trace": trace}
 
 
 def _cases(problem):
@@ -46,7 +47,7 @@ def _cases(problem):
 
 
 def _counterexample(left_source, right_source, cases, max_length):
-    left, right = parse(left_source), parse(right_source)
+    left, right = parse_program(left_source), parse_program(right_source)
     for case in cases:
         left_result = execute_with_limits(
             left, case["input"], max_steps=2000, max_length=max_length
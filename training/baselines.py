@@ -2,9 +2,10 @@
 
 from dataclasses import dataclass
 
-from A2B import A2BParseException, parse
+from A2B import A2BParseException
 
-from .dataset import execute_with_limits
+from .dataset import execute_batch
+from .programs import parse_program
 
 
 @dataclass(frozen=True)
@@ -56,19 +57,18 @@ def _passes(source, cases, problem):
     if len(source) > problem.max_program_characters:
         return False
     try:
-        program = parse(source)
+        program = parse_program(source)
     except A2BParseException:
         return False
-    for case in cases:
-        outcome = execute_with_limits(
-            program,
-            case["input"],
-            max_steps=10000,
-            max_length=problem.max_string_length,
-        )
-        if not outcome.terminating or outcome.output != case["output"]:
-            return False
-    return True
+    batch = execute_batch(
+        program,
+        (case["input"] for case in cases),
+        max_steps=10000,
+        max_length=problem.max_string_length,
+        detect_cycles=True,
+        expected=(case["output"] for case in cases),
+    )
+    return batch.mismatch is None
 
 
 class IdentityBaseline(Baseline):
@@ -9,6 +9,7 @@ from .cognitive_smoke import (
     record_cognitive_test_results,
     write_cognitive_smoke,
 )
+from .programs import PARSE_CACHE
 
 
 def command_generate(args):
@@ -30,6 +31,7 @@ def command_generate(args):
         "review_checks_passed": result["checks"]["passed"],
         "audit_passed": result["audit"]["passed"],
         "artifact_directory": str(args.output.resolve()),
+        "parse_cache": PARSE_CACHE.counters(),
     }
     print(json.dumps(summary, ensure_ascii=False, indent=2))
     return 0 if result["checks"]["passed"] and result["audit"]["passed"] else 2
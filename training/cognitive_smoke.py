@@ -10,8 +10,6 @@ from collections import Counter
 from dataclasses import asdict, dataclass, replace
 from pathlib import Path
 
-from A2B import parse
-
 from .auxiliary import generate_auxiliary_tasks
 from .baselines import run_baselines
 from .dataset import (
@@ -19,13 +17,14 @@ from .dataset import (
     GeneratedProblem,
     QualityMetrics,
     behavior_signature,
-    execute_with_limits,
+    execute_batch,
     quality_metrics,
     select_public_hidden,
 )
 from .fingerprints import semantic_fingerprint, structural_fingerprint
 from .generation import GeneratedProgram
 from .jsonl import read_jsonl, write_jsonl
+from .programs import parse_program
 from .schema import validate_cognitive_task
 
 
@@ -426,20 +425,21 @@ def _load_task_problem(root, task_id, profile, rng):
     solve = _load_groundtruth(directory / "groundtruth.py")
     pretests = list(read_jsonl(directory / "testcase_pretest.jsonl"))
     full = list(read_jsonl(directory / "testcase_full.jsonl"))
-    cases = []
+    inputs = []
+    expected = []
     seen = set()
-    parsed = parse(program)
     for case in pretests + full:
         if case["input"] in seen:
             continue
         seen.add(case["input"])
-        expected = solve(case["input"])
-        if expected != case["output"]:
+        if solve(case["input"]) != case["output"]:
             raise ValueError("groundtruth mismatch for task %s" % task_id)
-        outcome = execute_with_limits(parsed, case["input"], max_steps=100000, max_length=MAX_RUNTIME_STRING_LENGTH)
-        if not outcome.terminating or outcome.output != expected:
-            raise ValueError("A=B mismatch for task %s on %r" % (task_id, case["input"]))
-        cases.append(outcome)
+        inputs.append(case["input"])
+        expected.append(case["output"])
+    batch = execute_batch(parse_program(program), inputs, max_steps=100000, max_length=MAX_RUNTIME_STRING_LENGTH, expected=expected)
+    if batch.mismatch is not None:
+        raise ValueError("A=B mismatch for task %s on %r" % (task_id, inputs[batch.mismatch]))
+    cases = list(batch.outcomes())
     public_inputs = {case["input"] for case in pretests}
     hidden = tuple(case for case in full if case["input"] not in public_inputs)
     constraints = task.get("constraints", {})
@@ -465,18 +465,17 @@ def _load_task_problem(root, task_id, profile, rng):
 
 def _extra_problem(spec, rng):
     inputs = _extra_inputs(spec, rng)
-    parsed = parse(spec.program)
-    outcomes = []
+    expected_outputs = tuple(_oracle(spec.oracle_name, value) for value in inputs)
+    batch = execute_batch(parse_program(spec.program), inputs, max_steps=100000, max_length=MAX_RUNTIME_STRING_LENGTH, expected=expected_outputs)
+    if batch.mismatch is not None:
+        index = batch.mismatch
+        raise ValueError("extra %s mismatch on %r: %r != %r" % (spec.id, inputs[index], batch.outputs[index], expected_outputs[index]))
+    outcomes = list(batch.outcomes())
     component_effective = [False] * spec.profile.depth
     order_sensitive = False
     distinguishing_input = None
     order_outputs = None
-    for value in inputs:
-        expected = _oracle(spec.oracle_name, value)
-        outcome = execute_with_limits(parsed, value, max_steps=100000, max_length=MAX_RUNTIME_STRING_LENGTH)
-        if not outcome.terminating or outcome.output != expected:
-            raise ValueError("extra %s mismatch on %r: %r != %r" % (spec.id, value, outcome.output, expected))
-        outcomes.append(outcome)
+    for value, expected in zip(inputs, expected_outputs):
         if spec.profile.depth > 1:
             ablated, swapped = _composition_counterfactuals(
                 spec.oracle_name,
@@ -880,12 +879,17 @@ def audit_cognitive_smoke(directory):
     for record in records:
         if len(record["reference_programs"][0].splitlines()) > MAX_PROGRAM_LINES or len(record["reference_programs"][0]) > MAX_PROGRAM_CHARACTERS:
             failures.append(record["id"] + ":program_limit")
-        program = parse(record["reference_programs"][0])
-        for case in record["public_tests"] + record["hidden_tests"]:
-            outcome = execute_with_limits(program, case["input"], max_steps=100000, max_length=MAX_RUNTIME_STRING_LENGTH)
-            if not outcome.terminating or outcome.output != case["output"]:
-                failures.append(record["id"] + ":reference_mismatch")
-                break
+        cases = record["public_tests"] + record["hidden_tests"]
+        batch = execute_batch(
+            parse_program(record["reference_programs"][0]),
+            (case["input"] for case in cases),
+            max_steps=100000,
+            max_length=MAX_RUNTIME_STRING_LENGTH,
+            engine="python",
+            expected=(case["output"] for case in cases),
+        )
+        if batch.mismatch is not None:
+            failures.append(record["id"] + ":reference_mismatch")
     auxiliary_cross_split = 0
     for path in sorted((directory / "auxiliary").glob("*/*.jsonl")):
         split = path.parent.name
@@ -4,10 +4,26 @@ import hashlib
 import itertools
 import json
 import random
-from collections import Counter
-from dataclasses import asdict, dataclass, field
-
-from A2B import EXECUTED_DONE, EXECUTED_NONE, EXECUTED_RETURN, parse
+import time
+from array import array
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field, replace
+
+from A2B import (
+    DEFAULT_ENGINE,
+    LIMIT_CYCLE,
+    LIMIT_DEADLINE,
+    LIMIT_LENGTH,
+    LIMIT_STEPS,
+    LIMIT_STOPPED,
+    LIMIT_WORK,
+    ExecutionContext,
+    compile_python,
+    interpret,
+    stepping_engine,
+    transducer,
+)
 
 from .generation import (
     FailureReason,
@@ -18,6 +34,9 @@ from .generation import (
     TemplateCatalog,
 )
 from .fingerprints import semantic_fingerprint, structural_fingerprint
+from .lockstep import available as lockstep_available
+from .lockstep import run_lockstep
+from .programs import parse_program
 
 
 HARDENING_TASK_FIELDS = {
@@ -113,6 +132,113 @@ class ExecutionOutcome:
     steps: int = 0
     terminating: bool = False
     error: str = None
+    cycle_length: int = None
+
+
+STATUS_HALTED = 0
+STATUS_INPUT_LENGTH_LIMIT = 1
+STATUS_STEP_LIMIT = 2
+STATUS_STRING_LENGTH_LIMIT = 3
+STATUS_CYCLE = 4
+STATUS_WORK_LIMIT = 5
+STATUS_DEADLINE = 6
+STATUS_ERRORS = {
+    STATUS_INPUT_LENGTH_LIMIT: "input_length_limit",
+    STATUS_STEP_LIMIT: "execution_step_limit",
+    STATUS_STRING_LENGTH_LIMIT: "string_length_limit",
+    STATUS_CYCLE: "execution_cycle",
+    STATUS_WORK_LIMIT: "work_limit",
+    STATUS_DEADLINE: "deadline_exceeded",
+}
+# Smaller batches finish faster in-process than a pool can start.
+BATCH_POOL_THRESHOLD = 256
+BATCH_POOLS = {"process": ProcessPoolExecutor, "thread": ThreadPoolExecutor}
+# Engines that may run a whole input in one call: programs that compile to
+# a transducer run as a table loop, and the python engine runs its generated
+# code; anything else steps through the engine as usual.
+WHOLE_RUN_ENGINES = {"python", "bulk"}
+# Batches only: every input of a chunk of at least LOCKSTEP_MIN_BATCH
+# advances one step per round through NumPy, and inputs or runs too long for
+# that continue on the fallback engine.  Smaller chunks, single runs, and
+# runs without NumPy use the fallback engine throughout.
+LOCKSTEP_ENGINE = "lockstep"
+LOCKSTEP_FALLBACK_ENGINE = "bulk"
+LOCKSTEP_MIN_BATCH = 256
+LIMIT_STATUSES = {
+    None: STATUS_HALTED,
+    LIMIT_STEPS: STATUS_STEP_LIMIT,
+    LIMIT_LENGTH: STATUS_STRING_LENGTH_LIMIT,
+    LIMIT_WORK: STATUS_WORK_LIMIT,
+    LIMIT_DEADLINE: STATUS_DEADLINE,
+    LIMIT_CYCLE: STATUS_CYCLE,
+}
+DEFAULT_MEMO_ENTRIES = 65536
+
+
+class TranspositionTable:
+    """Bounded LRU of execution states reached while running one batch.
+
+    Keys are ``(string, once bitmask)`` configurations.  Values are
+    ``(status, output, remaining)`` where ``remaining`` counts the steps from
+    that configuration to the recorded outcome; for step-limit outcomes it is
+    only a lower bound on the steps that run without halting.
+    """
+
+    def __init__(self, max_entries=DEFAULT_MEMO_ENTRIES):
+        if isinstance(max_entries, bool) or not isinstance(max_entries, int) or max_entries <= 0:
+            raise ValueError("max_entries must be a positive integer")
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def put(self, key, entry):
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+
+@dataclass(frozen=True)
+class BatchOutcome:
+    """Columnar results of one program over many inputs, in input order."""
+
+    inputs: tuple
+    outputs: tuple
+    steps: array
+    statuses: bytes
+    mismatch: int = None
+    cycle_lengths: dict = field(default_factory=dict)
+
+    def __len__(self):
+        return len(self.inputs)
+
+    def terminating(self, index):
+        return self.statuses[index] == STATUS_HALTED
+
+    def outcome(self, index):
+        return _outcome(
+            self.inputs[index],
+            self.statuses[index],
+            self.outputs[index],
+            self.steps[index],
+            self.cycle_lengths.get(index),
+        )
+
+    def outcomes(self):
+        return tuple(self.outcome(index) for index in range(len(self)))
 
 
 @dataclass(frozen=True)
@@ -227,58 +353,310 @@ class DatasetGenerationResult:
     requested: int
 
 
-def execute_with_limits(program, input_value, *, max_steps, max_length):
-    """Execute a parsed program and return termination/step information."""
-    for expression in program.exprs:
-        expression.executed = 0
-
-    line = input_value
-    steps = 0
-    if len(line) > max_length:
-        return ExecutionOutcome(
-            input=input_value,
-            steps=steps,
-            terminating=False,
-            error="input_length_limit",
+@dataclass(frozen=True)
+class _RunOptions:
+    max_steps: int
+    max_length: int
+    engine: str = DEFAULT_ENGINE
+    detect_cycles: bool = False
+    max_work: int = None
+    timeout: float = None
+
+    @property
+    def budgeted(self):
+        return self.max_work is not None or self.timeout is not None
+
+    @property
+    def whole_run(self):
+        return (
+            self.engine in WHOLE_RUN_ENGINES
+            and not self.detect_cycles
+            and not self.budgeted
         )
 
-    while True:
-        executed = EXECUTED_NONE
-        for expression in program.exprs:
-            executed, output = expression.Execute(line)
-            if executed in (EXECUTED_DONE, EXECUTED_RETURN):
-                steps += 1
-                line = output
-                break
+
+def _run_whole(program, input_value, options):
+    machine = program.compile("transducer", transducer)
+    result = None
+    if machine is not None:
+        result = machine.run(input_value, options.max_steps, options.max_length)
+    if result is None and options.engine == "python":
+        run = program.compile("python", compile_python).run
+        result = run(input_value, options.max_steps, options.max_length)
+    if result is None:
+        return None
+    output, steps, limit = result
+    return LIMIT_STATUSES[limit], output, steps, None
+
+
+def _run_with_limits(program, input_value, options):
+    if len(input_value) > options.max_length:
+        return STATUS_INPUT_LENGTH_LIMIT, None, 0, None
+    if options.whole_run:
+        result = _run_whole(program, input_value, options)
+        if result is not None:
+            return result
+
+    deadline = None if options.timeout is None else time.perf_counter() + options.timeout
+    context = ExecutionContext(options.max_steps, options.max_length, options.max_work, deadline)
+    limit, output, cycle = interpret(
+        program, input_value, context, options.engine, options.detect_cycles
+    )
+    return LIMIT_STATUSES[limit], output, context.steps, cycle
+
+
+def _resolve_memo(entry, steps, max_steps):
+    status, output, remaining = entry
+    if status == STATUS_STEP_LIMIT:
+        if steps + remaining > max_steps:
+            return STATUS_STEP_LIMIT, None, max_steps + 1, None
+        return None
+    if steps + remaining > max_steps:
+        return STATUS_STEP_LIMIT, None, max_steps + 1, None
+    return status, output, steps + remaining, None
+
+
+class _MemoLookup:
+    """``interpret`` hook that ends a run at the first remembered configuration."""
+
+    def __init__(self, table, max_steps):
+        self.table = table
+        self.max_steps = max_steps
+        # Entries that would be evicted anyway are not worth remembering.
+        self.path = deque(maxlen=table.max_entries)
+        self.result = None
+
+    def __call__(self, state, context):
+        key = (state.value(), context.once)
+        entry = self.table.get(key)
+        if entry is not None:
+            self.result = _resolve_memo(entry, context.steps, self.max_steps)
+            if self.result is not None:
+                return True
+        self.path.append((context.steps, key))
+        return False
+
+
+def _run_memoized(program, input_value, options, table):
+    if len(input_value) > options.max_length:
+        return STATUS_INPUT_LENGTH_LIMIT, None, 0, None
+    # A whole-program run beats any table lookup, so only the programs
+    # without one are memoized.
+    if options.whole_run:
+        result = _run_whole(program, input_value, options)
+        if result is not None:
+            return result
+
+    context = ExecutionContext(options.max_steps, options.max_length)
+    lookup = _MemoLookup(table, options.max_steps)
+    limit, output, cycle = interpret(
+        program, input_value, context, options.engine, options.detect_cycles,
+        before_step=lookup,
+    )
+    if limit == LIMIT_STOPPED:
+        result = lookup.result
+    else:
+        result = LIMIT_STATUSES[limit], output, context.steps, cycle
+
+    status, output, total, _ = result
+    # Where a cycle is reported depends on where detection started, so
+    # neither cycles nor (with detection on) step limits can be reused.
+    if status == STATUS_CYCLE or (options.detect_cycles and status == STATUS_STEP_LIMIT):
+        return result
+    # A looping run revisits configurations; the earliest visit has the
+    # largest remaining bound, so it is written last.
+    for visited, key in reversed(lookup.path):
+        table.put(key, (status, output, total - visited))
+    return result
+
+
+def _outcome(input_value, status, output, steps, cycle_length):
+    return ExecutionOutcome(
+        input=input_value,
+        output=output,
+        steps=steps,
+        terminating=status == STATUS_HALTED,
+        error=STATUS_ERRORS.get(status),
+        cycle_length=cycle_length,
+    )
+
+
+def execute_with_limits(
+    program,
+    input_value,
+    *,
+    max_steps,
+    max_length,
+    engine=DEFAULT_ENGINE,
+    detect_cycles=False,
+    max_work=None,
+    timeout=None,
+):
+    """Execute a parsed program and return termination/step information.
+
+    With ``detect_cycles`` a repeated (string, once-state) configuration is
+    reported as ``execution_cycle`` together with the cycle length instead
+    of running until ``max_steps``.  ``max_work`` bounds the characters the
+    run scans and copies (each step costs the length of the string before
+    it plus the length after it) and stops with ``work_limit``; ``timeout``
+    is a wall-clock limit in seconds that stops with ``deadline_exceeded``.
+    ``engine="python"`` runs code generated from the program, compiled once
+    per distinct rule set.
+    """
+    if engine == LOCKSTEP_ENGINE:
+        engine = LOCKSTEP_FALLBACK_ENGINE
+    if detect_cycles or max_work is not None:
+        engine = stepping_engine(engine)
+    options = _RunOptions(max_steps, max_length, engine, detect_cycles, max_work, timeout)
+    return _outcome(input_value, *_run_with_limits(program, input_value, options))
+
+
+def _run_lockstep(program, inputs, options):
+    # Inputs the lockstep runner cannot pack run one at a time instead.
+    def packed(value):
+        return len(value) <= options.max_length and value.isascii()
+
+    runs = iter(
+        run_lockstep(
+            program,
+            [value for value in inputs if packed(value)],
+            options.max_steps,
+            options.max_length,
+            LOCKSTEP_FALLBACK_ENGINE,
+        )
+    )
+    scalar = replace(options, engine=LOCKSTEP_FALLBACK_ENGINE)
+    for value in inputs:
+        if packed(value):
+            output, steps, limit = next(runs)
+            yield LIMIT_STATUSES[limit], output, steps, None
         else:
-            return ExecutionOutcome(
-                input=input_value,
-                output=line,
-                steps=steps,
-                terminating=True,
-            )
+            yield _run_with_limits(program, value, scalar)
+
+
+def _execute_chunk(program, inputs, options, expected, memo_entries):
+    outputs = []
+    steps = array("q")
+    statuses = bytearray()
+    cycle_lengths = {}
+    if options.engine == LOCKSTEP_ENGINE and len(inputs) >= LOCKSTEP_MIN_BATCH:
+        results = _run_lockstep(program, inputs, options)
+    elif options.engine == LOCKSTEP_ENGINE:
+        return _execute_chunk(
+            program,
+            inputs,
+            replace(options, engine=LOCKSTEP_FALLBACK_ENGINE),
+            expected,
+            memo_entries,
+        )
+    elif memo_entries and not options.budgeted:
+        table = TranspositionTable(memo_entries)
+        results = (_run_memoized(program, value, options, table) for value in inputs)
+    else:
+        # Reused outcomes would skip the work and time a budget measures.
+        results = (_run_with_limits(program, value, options) for value in inputs)
+    for index, (status, output, count, cycle) in enumerate(results):
+        outputs.append(output)
+        steps.append(count)
+        statuses.append(status)
+        if cycle is not None:
+            cycle_lengths[index] = cycle
+        if expected is not None and (
+            status != STATUS_HALTED or output != expected[index]
+        ):
+            return outputs, steps, statuses, cycle_lengths, index
+    return outputs, steps, statuses, cycle_lengths, None
 
-        if steps > max_steps:
-            return ExecutionOutcome(
-                input=input_value,
-                steps=steps,
-                terminating=False,
-                error="execution_step_limit",
-            )
-        if len(line) > max_length:
-            return ExecutionOutcome(
-                input=input_value,
-                steps=steps,
-                terminating=False,
-                error="string_length_limit",
-            )
-        if executed == EXECUTED_RETURN:
-            return ExecutionOutcome(
-                input=input_value,
-                output=line,
-                steps=steps,
-                terminating=True,
+
+def execute_batch(
+    program,
+    inputs,
+    *,
+    max_steps,
+    max_length,
+    engine=DEFAULT_ENGINE,
+    detect_cycles=False,
+    expected=None,
+    workers=None,
+    pool="process",
+    memo_entries=None,
+    max_work=None,
+    timeout=None,
+):
+    """Run one parsed program over many inputs with shared compiled state.
+
+    With ``expected`` outputs the batch stops at the first input that does not
+    terminate with its expected output and records its index as ``mismatch``.
+    Batches of at least ``BATCH_POOL_THRESHOLD`` inputs fan out over a pool
+    of ``workers`` processes when ``workers`` is greater than one; with
+    ``pool="thread"`` the workers are threads sharing the parsed program.  A
+    positive ``memo_entries`` shares a ``TranspositionTable`` of that size
+    between the inputs (one per pool chunk), so inputs that reach a known
+    configuration reuse its outcome; step counts and limit outcomes stay
+    exact.  ``max_work`` and ``timeout`` apply to each input separately, as
+    in ``execute_with_limits``, and turn memoization off.  With
+    ``engine="lockstep"`` and NumPy installed, each large chunk runs as one
+    vectorised batch with the same results (no memoization); smaller chunks,
+    and every chunk without NumPy or with a budget or cycle detection, run
+    on the bulk engine, memoized as usual.
+    """
+    inputs = tuple(inputs)
+    if expected is not None:
+        expected = tuple(expected)
+        if len(expected) != len(inputs):
+            raise ValueError("expected outputs must match inputs")
+    if engine == LOCKSTEP_ENGINE and (
+        detect_cycles
+        or max_work is not None
+        or timeout is not None
+        or not lockstep_available()
+    ):
+        engine = LOCKSTEP_FALLBACK_ENGINE
+    if detect_cycles or max_work is not None:
+        engine = stepping_engine(engine)
+    options = _RunOptions(max_steps, max_length, engine, detect_cycles, max_work, timeout)
+    if pool not in BATCH_POOLS:
+        raise ValueError("unknown pool %r" % pool)
+    if workers and workers > 1 and len(inputs) >= BATCH_POOL_THRESHOLD:
+        size = -(-len(inputs) // (workers * 4))
+        starts = range(0, len(inputs), size)
+        with BATCH_POOLS[pool](max_workers=workers) as executor:
+            chunks = executor.map(
+                _execute_chunk,
+                itertools.repeat(program),
+                (inputs[start : start + size] for start in starts),
+                itertools.repeat(options),
+                (
+                    None if expected is None else expected[start : start + size]
+                    for start in starts
+                ),
+                itertools.repeat(memo_entries),
             )
+            outputs, steps, statuses, cycle_lengths = [], array("q"), bytearray(), {}
+            mismatch = None
+            for start, chunk in zip(starts, chunks):
+                chunk_outputs, chunk_steps, chunk_statuses, chunk_cycles, chunk_mismatch = chunk
+                outputs.extend(chunk_outputs)
+                steps.extend(chunk_steps)
+                statuses.extend(chunk_statuses)
+                cycle_lengths.update(
+                    (start + index, cycle) for index, cycle in chunk_cycles.items()
+                )
+                if chunk_mismatch is not None:
+                    mismatch = start + chunk_mismatch
+                    break
+    else:
+        outputs, steps, statuses, cycle_lengths, mismatch = _execute_chunk(
+            program, inputs, options, expected, memo_entries
+        )
+    return BatchOutcome(
+        inputs=inputs[: len(outputs)],
+        outputs=tuple(outputs),
+        steps=steps,
+        statuses=bytes(statuses),
+        mismatch=mismatch,
+        cycle_lengths=cycle_lengths,
+    )
 
 
 def _input_spec(generated):
@@ -371,16 +749,13 @@ def build_input_pool(rng, generated, config):
 
 
 def evaluate_inputs(generated, inputs, config):
-    program = parse(generated.program)
-    return tuple(
-        execute_with_limits(
-            program,
-            value,
-            max_steps=config.max_execution_steps,
-            max_length=generated.limits["max_string_length"],
-        )
-        for value in inputs
-    )
+    return execute_batch(
+        parse_program(generated.program),
+        inputs,
+        max_steps=config.max_execution_steps,
+        max_length=generated.limits["max_string_length"],
+        engine=LOCKSTEP_ENGINE,
+    ).outcomes()
 
 
 def _case(outcome):
@@ -419,22 +794,22 @@ def _simple_hypothesis_mismatches(outcomes):
     max_length = max(
         [len(value) for value in reference] + [len(value) for value in reference.values()] + [1]
     ) + 32
+    inputs = tuple(outcome.input for outcome in outcomes)
     mismatches = []
     for source in sources:
         try:
-            program = parse(source)
+            program = parse_program(source)
         except Exception:
             continue
-        wrong = set()
-        for outcome in outcomes:
-            candidate = execute_with_limits(
-                program,
-                outcome.input,
-                max_steps=1000,
-                max_length=max_length,
-            )
-            if not candidate.terminating or candidate.output != outcome.output:
-                wrong.add(outcome.input)
+        candidates = execute_batch(
+            program, inputs, max_steps=1000, max_length=max_length, detect_cycles=True
+        )
+        wrong = {
+            outcome.input
+            for index, outcome in enumerate(outcomes)
+            if not candidates.terminating(index)
+            or candidates.outputs[index] != outcome.output
+        }
         if wrong and len(wrong) < len(outcomes):
             mismatches.append(wrong)
     return mismatches
@@ -7,7 +7,9 @@ from dataclasses import dataclass, field
 from enum import Enum
 from types import MappingProxyType
 
-from A2B import A2BParseException, parse
+from A2B import A2BParseException
+
+from .programs import parse_program
 
 
 class FailureReason(str, Enum):
@@ -312,7 +314,7 @@ class TemplateCatalog:
                 "template did not preserve max_string_length",
             )
         try:
-            parse(generated.program)
+            parse_program(generated.program)
         except A2BParseException as error:
             raise GenerationRejected(FailureReason.SYNTAX_ERROR, str(error)) from error
         return generated
@@ -4,12 +4,11 @@ import random
 from collections import Counter
 from dataclasses import dataclass, replace
 
-from A2B import parse
-
-from .dataset import DatasetGenerationResult, execute_with_limits
+from .dataset import DatasetGenerationResult, execute_batch
 from .diversity import DiversityConfig, generate_diversity_smoke
 from .generation import GenerationStats
 from .ir import IROperation, TaskIR
+from .programs import parse_program
 from .schema import validate_hardened_task
 from .semantic_hardening import (
     _targeted_inputs,
@@ -58,7 +57,7 @@ def _ir_from_problem(problem):
     )
 
 
-def verify_reference_on_audit_domain(problem, analysis):
+def verify_reference_on_audit_domain(problem, analysis, *, memo_entries=None):
     ir = _ir_from_problem(problem)
     if ir is None:
         return {"attempted": 0, "verified": 0, "fraction": 1.0}
@@ -70,17 +69,17 @@ def verify_reference_on_audit_domain(problem, analysis):
         cap=audit["probe_cap"],
         seed=int(problem.behavior_signature[:12], 16),
     )
-    program = parse(problem.generated_program.program)
-    verified = 0
-    for value in inputs:
-        result = execute_with_limits(
-            program,
-            value,
-            max_steps=10000,
-            max_length=problem.generated_program.limits["max_string_length"],
-        )
-        if result.terminating and result.output == ir.apply(value):
-            verified += 1
+    batch = execute_batch(
+        parse_program(problem.generated_program.program),
+        inputs,
+        max_steps=10000,
+        max_length=problem.generated_program.limits["max_string_length"],
+        memo_entries=memo_entries,
+    )
+    verified = sum(
+        batch.terminating(index) and batch.outputs[index] == ir.apply(value)
+        for index, value in enumerate(inputs)
+    )
     return {
         "attempted": len(inputs),
         "verified": verified,
@@ -5,9 +5,8 @@ import json
 from collections import Counter, defaultdict
 from dataclasses import dataclass
 
-from A2B import parse
-
 from .dataset import execute_with_limits
+from .programs import parse_program
 
 
 HARDENING_SPLITS = (
@@ -73,8 +72,8 @@ def _alternate_description(description):
 
 
 def _equivalent_on_problem_cases(problem, variant_program):
-    left = parse(problem.generated_program.program)
-    right = parse(variant_program)
+    left = parse_program(problem.generated_program.program)
+    right = parse_program(variant_program)
     maximum = problem.generated_program.limits["max_string_length"]
     for case in tuple(problem.public_tests) + tuple(problem.hidden_tests):
         left_result = execute_with_limits(
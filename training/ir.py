@@ -4,10 +4,9 @@ import itertools
 import json
 from dataclasses import dataclass
 
-from A2B import parse
-
-from .dataset import execute_with_limits
+from .dataset import LOCKSTEP_ENGINE, execute_batch
 from .generation import FailureReason, GeneratedProgram, GenerationRejected
+from .programs import parse_program
 
 
 SUPPORTED_OPERATIONS = {
@@ -713,27 +712,38 @@ def exhaustive_inputs(alphabet, minimum, maximum):
             yield "".join(chars)
 
 
-def verify_ir_oracle(ir, generated, *, maximum_length, max_steps=10000):
-    program = parse(generated.program)
+def verify_ir_oracle(
+    ir, generated, *, maximum_length, max_steps=10000, memo_entries=None
+):
+    program = parse_program(generated.program)
     minimum = generated.parameters.get("min_input_length", 0)
-    for value in exhaustive_inputs(ir.input_alphabet, minimum, maximum_length):
-        if (
+    inputs = tuple(
+        value
+        for value in exhaustive_inputs(ir.input_alphabet, minimum, maximum_length)
+        if not (
             generated.parameters.get("forbid_leading_zero")
             and len(value) > 1
             and value.startswith("0")
-        ):
-            continue
-        expected = ir.apply(value)
-        outcome = execute_with_limits(
-            program,
-            value,
-            max_steps=max_steps,
-            max_length=generated.limits["max_string_length"],
         )
-        if not outcome.terminating or outcome.output != expected:
-            raise GenerationRejected(
-                FailureReason.VERIFIER_FAILURE,
-                "IR mismatch on %r: expected %r, got %r"
-                % (value, expected, outcome.output),
-            )
+    )
+    expected = tuple(ir.apply(value) for value in inputs)
+    batch = execute_batch(
+        program,
+        inputs,
+        max_steps=max_steps,
+        max_length=generated.limits["max_string_length"],
+        expected=expected,
+        engine=LOCKSTEP_ENGINE,
+        memo_entries=memo_entries,
+    )
+    if batch.mismatch is not None:
+        raise GenerationRejected(
+            FailureReason.VERIFIER_FAILURE,
+            "IR mismatch on %r: expected %r, got %r"
+            % (
+                inputs[batch.mismatch],
+                expected[batch.mismatch],
+                batch.outputs[batch.mismatch],
+            ),
+        )
     return True
@@ -0,0 +1,245 @@
+"""Lockstep execution of one program over a batch of inputs with NumPy.
+
+NumPy is optional; ``available()`` reports whether it can be imported, and
+``execute_batch(engine="lockstep")`` runs inputs one at a time without it.
+"""
+
+from A2B import (
+    DEFAULT_ENGINE,
+    MATCH_ANYWHERE,
+    MATCH_START,
+    PLACE_INLINE,
+    PLACE_RETURN,
+    PLACE_START,
+    ExecutionContext,
+    compiled_rules,
+    exceeded,
+    interpret,
+)
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - depends on the environment
+    np = None
+
+
+# Rows live in a buffer this many times as wide as the longest input (and
+# at least LOCKSTEP_MIN_WIDTH wide).  Rows finish on a scalar engine from
+# where they are when they would outgrow it, when fewer than
+# LOCKSTEP_MIN_ROWS are left, or after LOCKSTEP_MAX_ROUNDS rounds; inputs
+# longer than LOCKSTEP_MAX_INPUT run on it from the start.  Long inputs and
+# long runs are where the bulk engine's collapsed steps win.
+LOCKSTEP_WIDTH_FACTOR = 4
+LOCKSTEP_MIN_WIDTH = 32
+LOCKSTEP_MIN_ROWS = 16
+LOCKSTEP_MAX_ROUNDS = 256
+LOCKSTEP_MAX_INPUT = 32
+
+
+def available():
+    return np is not None
+
+
+class _Rows:
+    """The running rows of a batch: their strings, lengths and step counts."""
+
+    def __init__(self, index, buffer, lengths, steps, spent):
+        self.index = index
+        self.buffer = buffer
+        self.lengths = lengths
+        self.steps = steps
+        self.spent = spent
+
+    def __len__(self):
+        return len(self.index)
+
+    def keep(self, mask):
+        return _Rows(
+            self.index[mask],
+            self.buffer[mask],
+            self.lengths[mask],
+            self.steps[mask],
+            self.spent[mask],
+        )
+
+    def line(self, row):
+        return self.buffer[row, : self.lengths[row]].tobytes().decode("ascii")
+
+    def lines(self, rows):
+        width = self.buffer.shape[1]
+        data = self.buffer[rows].tobytes()
+        return [
+            data[offset * width : offset * width + length].decode("ascii")
+            for offset, length in enumerate(self.lengths[rows].tolist())
+        ]
+
+    def once(self, row):
+        return sum(1 << int(index) for index in np.flatnonzero(self.spent[row]))
+
+
+def _codes(text):
+    return np.frombuffer(text.encode("ascii"), dtype=np.uint8)
+
+
+def _match(rule, pattern, view, lengths):
+    # Which rows the rule matches and where its leftmost match starts.
+    rows, width = view.shape
+    size = rule.size
+    if size == 0:
+        hit = np.ones(rows, dtype=bool)
+        if rule.match == MATCH_ANYWHERE or rule.match == MATCH_START:
+            return hit, np.zeros(rows, dtype=np.int64)
+        return hit, lengths.copy()
+    if width < size:
+        return np.zeros(rows, dtype=bool), np.zeros(rows, dtype=np.int64)
+    if rule.match == MATCH_ANYWHERE:
+        starts = width - size + 1
+        found = view[:, :starts] == pattern[0]
+        for offset in range(1, size):
+            found &= view[:, offset : offset + starts] == pattern[offset]
+        found &= np.arange(starts) <= (lengths - size)[:, None]
+        return found.any(axis=1), found.argmax(axis=1)
+    if rule.match == MATCH_START:
+        hit = (lengths >= size) & (view[:, :size] == pattern).all(axis=1)
+        return hit, np.zeros(rows, dtype=np.int64)
+    start = lengths - size
+    columns = np.clip(start[:, None] + np.arange(size), 0, width - 1)
+    window = np.take_along_axis(view, columns, axis=1)
+    return (start >= 0) & (window == pattern).all(axis=1), start
+
+
+def _rewrite(rule, replacement, source, start, lengths, width):
+    # The first `width` columns of the rows of `source` with the rule
+    # applied at `start`, built as one gather from the old rows plus the
+    # replacement written over its slot.
+    size, extra = rule.size, len(replacement)
+    column = np.arange(width)[None, :]
+    start = start[:, None]
+    if rule.place == PLACE_INLINE:
+        origin = np.where(column >= start + extra, column - extra + size, column)
+        slot = (column >= start) & (column < start + extra)
+    elif rule.place == PLACE_START:
+        origin = np.where(column < extra + start, column - extra, column - extra + size)
+        slot = np.broadcast_to(column < extra, origin.shape)
+    else:
+        origin = np.where(column < start, column, column + size)
+        end = (lengths - size)[:, None]
+        slot = (column >= end) & (column < end + extra)
+    rows = np.take_along_axis(source, np.clip(origin, 0, source.shape[1] - 1), axis=1)
+    if extra:
+        rows[slot] = np.tile(replacement, len(rows))
+    return rows
+
+
+def run_lockstep(program, inputs, max_steps, max_length, engine=DEFAULT_ENGINE):
+    """Run ``program`` over ``inputs`` in lockstep; one result per input.
+
+    Every round finds each running row's first applicable rule with
+    vectorised window comparisons and applies the rewrites rule by rule
+    with gathers.  Results are ``(output, steps, limit)`` as returned by
+    the generated ``run()``: exactly what the scalar interpreter gives.
+    Rows that leave the lockstep finish on ``engine``.  Inputs must be
+    ASCII and at most ``max_length`` long.
+    """
+    def finish(line, steps, once):
+        context = ExecutionContext(max_steps, max_length)
+        context.steps = steps
+        context.once = once
+        limit, output, _ = interpret(program, line, context, engine)
+        return output, context.steps, limit
+
+    results = [None] * len(inputs)
+    rows = []
+    for row, value in enumerate(inputs):
+        if len(value) > LOCKSTEP_MAX_INPUT:
+            results[row] = finish(value, 0, 0)
+        else:
+            rows.append(row)
+    values = [inputs[row] for row in rows]
+    rules = program.compile("kernel", compiled_rules)
+    patterns = [_codes(rule.pattern) for rule in rules]
+    replacements = [_codes(rule.replacement) for rule in rules]
+    longest = max((len(value) for value in values), default=0)
+    width = min(max_length, max(LOCKSTEP_MIN_WIDTH, LOCKSTEP_WIDTH_FACTOR * longest))
+    width = max(width, longest, 1)
+
+    packed = bytearray(b"".join(value.encode("ascii").ljust(width, b"\0") for value in values))
+    buffer = np.frombuffer(packed, dtype=np.uint8).reshape(len(values), width)
+    state = _Rows(
+        np.array(rows, dtype=np.int64),
+        buffer,
+        np.array([len(value) for value in values], dtype=np.int64),
+        np.zeros(len(values), dtype=np.int64),
+        np.zeros((len(values), len(rules)), dtype=bool),
+    )
+
+    for _ in range(LOCKSTEP_MAX_ROUNDS):
+        if len(state) < LOCKSTEP_MIN_ROWS:
+            break
+        view = state.buffer[:, : max(int(state.lengths.max()), 1)]
+        chosen = np.full(len(state), -1, dtype=np.int64)
+        starts = np.zeros(len(state), dtype=np.int64)
+        undecided = np.ones(len(state), dtype=bool)
+        for rule in rules:
+            hit, start = _match(rule, patterns[rule.index], view, state.lengths)
+            hit &= undecided
+            if rule.once:
+                hit &= ~state.spent[:, rule.index]
+            chosen[hit] = rule.index
+            starts[hit] = start[hit]
+            undecided &= ~hit
+            if not undecided.any():
+                break
+
+        running = chosen >= 0
+        halted = np.flatnonzero(~running)
+        for row, line in zip(halted.tolist(), state.lines(halted)):
+            results[state.index[row]] = (line, int(state.steps[row]), None)
+        state.steps[running] += 1
+        lengths = state.lengths.copy()
+        done = ~running
+        for rule in rules:
+            fired = chosen == rule.index
+            if not fired.any():
+                continue
+            if rule.once:
+                state.spent[fired, rule.index] = True
+            extra = len(rule.replacement)
+            if rule.place == PLACE_RETURN:
+                lengths[fired] = extra
+            else:
+                lengths[fired] += extra - rule.size
+            broken = fired & ((state.steps > max_steps) | (lengths > max_length))
+            for row in np.flatnonzero(broken):
+                steps = int(state.steps[row])
+                limit = exceeded(steps, int(lengths[row]), max_steps, max_length)
+                results[state.index[row]] = (None, steps, limit)
+            fired &= ~broken
+            if rule.place == PLACE_RETURN:
+                for row in np.flatnonzero(fired):
+                    results[state.index[row]] = (rule.replacement, int(state.steps[row]), None)
+                done |= broken | fired
+                continue
+            wide = fired & (lengths > width)
+            for row in np.flatnonzero(wide):
+                line = rule.apply(state.line(row))
+                results[state.index[row]] = finish(line, int(state.steps[row]), state.once(row))
+            fired &= ~wide
+            done |= broken | wide
+            if fired.any():
+                before = state.lengths[fired]
+                span = max(int(lengths[fired].max()), 1)
+                state.buffer[fired, :span] = _rewrite(
+                    rule, replacements[rule.index],
+                    state.buffer[fired, : max(int(before.max()), 1)],
+                    starts[fired], before, span,
+                )
+        state.lengths = lengths
+        if done.any():
+            state = state.keep(~done)
+
+    for row in range(len(state)):
+        results[state.index[row]] = finish(
+            state.line(row), int(state.steps[row]), state.once(row)
+        )
+    return results
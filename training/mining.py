@@ -4,12 +4,13 @@ import itertools
 import random
 from collections import defaultdict, deque
 
-from A2B import A2BParseException, parse
+from A2B import A2BParseException
 
 from .dataset import behavior_signature, execute_with_limits
 from .fingerprints import structural_fingerprint
 from .generation import GeneratedProgram, GenerationConfig
 from .ir import exhaustive_inputs
+from .programs import parse_program
 
 
 def describe_mined_program(source, alphabet=None, max_input_length=None):
@@ -67,12 +68,12 @@ def describe_mined_program(source, alphabet=None, max_input_length=None):
 def behavior_properties(source, alphabet, probe_inputs, outcomes):
     terminating = all(outcome.terminating for outcome in outcomes)
     outputs = [outcome.output for outcome in outcomes if outcome.terminating]
-    program = parse(source)
+    program = parse_program(source)
     idempotent = terminating
     if idempotent:
         for output in outputs:
             second = execute_with_limits(
-                program, output, max_steps=200, max_length=32
+                program, output, max_steps=200, max_length=32, detect_cycles=True
             )
             if not second.terminating or second.output != output:
                 idempotent = False
@@ -137,7 +138,7 @@ def mine_programs(*, seed, limit, config=None, allow_io_only=False):
             if len(source) > config.max_program_characters:
                 continue
             try:
-                program = parse(source)
+                program = parse_program(source)
             except A2BParseException:
                 continue
             outcomes = tuple(
@@ -146,6 +147,7 @@ def mine_programs(*, seed, limit, config=None, allow_io_only=False):
                     value,
                     max_steps=100,
                     max_length=config.max_string_length,
+                    detect_cycles=True,
                 )
                 for value in probes
             )
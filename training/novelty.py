@@ -4,10 +4,11 @@ import json
 from collections import Counter
 from dataclasses import dataclass
 
-from A2B import A2BParseException, parse
+from A2B import A2BParseException
 
 from .dataset import InputPoolConfig, ProblemBuildConfig, build_problem
 from .generation import FailureReason, GeneratedProgram, GenerationRejected
+from .programs import parse_program
 
 
 @dataclass(frozen=True)
@@ -185,7 +186,7 @@ def verify_teacher_proposal(proposal, rng, config, existing_problems=()):
             FailureReason.RESOURCE_LIMIT, "program character limit"
         )
     try:
-        parse(proposal["program"])
+        parse_program(proposal["program"])
     except A2BParseException as error:
         raise GenerationRejected(FailureReason.SYNTAX_ERROR, str(error)) from error
 
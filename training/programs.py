@@ -0,0 +1,74 @@
+"""Content-addressed cache of parsed A=B programs shared by the pipeline."""
+
+import hashlib
+import threading
+from collections import OrderedDict
+
+from A2B import parse
+
+
+DEFAULT_PARSE_CACHE_ENTRIES = 4096
+
+
+class ParseCache:
+    """Bounded, thread-safe LRU of parsed programs keyed by source hash.
+
+    Cached programs are shared by every caller; runs keep their state in an
+    ``ExecutionContext``, so sharing is safe across threads.  Sources that
+    fail to parse are not cached; the parse error is raised again on every
+    lookup.
+    """
+
+    def __init__(self, max_entries=DEFAULT_PARSE_CACHE_ENTRIES):
+        if isinstance(max_entries, bool) or not isinstance(max_entries, int) or max_entries <= 0:
+            raise ValueError("max_entries must be a positive integer")
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    @staticmethod
+    def key(source):
+        return hashlib.sha256(source.encode("utf-8")).hexdigest()
+
+    def parse(self, source):
+        key = self.key(source)
+        with self.lock:
+            program = self.entries.get(key)
+            if program is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return program
+            self.misses += 1
+
+        program = parse(source)
+        with self.lock:
+            # Another thread may have parsed the same source meanwhile; keep
+            # the first program so every caller shares one instance.
+            program = self.entries.setdefault(key, program)
+            self.entries.move_to_end(key)
+            if len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return program
+
+    def counters(self):
+        with self.lock:
+            return {"entries": len(self.entries), "hits": self.hits, "misses": self.misses}
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+PARSE_CACHE = ParseCache()
+
+
+def parse_program(source):
+    """Parse ``source`` through the shared ``PARSE_CACHE``."""
+    return PARSE_CACHE.parse(source)
@@ -9,13 +9,15 @@ import urllib.request
 from dataclasses import dataclass
 from pathlib import Path
 
-from A2B import A2BParseException, parse
+from A2B import A2BParseException
 
 from .dataset import (
     InputPoolConfig,
     build_input_pool,
+    execute_batch,
     execute_with_limits,
 )
+from .programs import parse_program
 from .prompt import build_prompt
 
 
@@ -158,15 +160,17 @@ def extract_candidate(content):
 
 
 def _check_cases(program, cases, max_length):
-    for case in cases:
-        outcome = execute_with_limits(
-            program,
-            case["input"],
-            max_steps=10000,
-            max_length=max_length,
-        )
-        if not outcome.terminating or outcome.output != case["output"]:
-            return False, dict(case)
+    cases = tuple(cases)
+    batch = execute_batch(
+        program,
+        (case["input"] for case in cases),
+        max_steps=10000,
+        max_length=max_length,
+        detect_cycles=True,
+        expected=(case["output"] for case in cases),
+    )
+    if batch.mismatch is not None:
+        return False, dict(cases[batch.mismatch])
     return True, None
 
 
@@ -181,7 +185,7 @@ def verify_candidate(source, problem):
     if not character_ok:
         return CandidateVerification(True, False, False, False, "character_limit")
     try:
-        program = parse(source)
+        program = parse_program(source)
     except A2BParseException:
         return CandidateVerification(False, False, False, False, "syntax")
     public_ok, public_failure = _check_cases(
@@ -231,8 +235,8 @@ def _teacher_messages(prompt, repair_feedback=None):
 def _fresh_counterexample(problem, candidate, seed):
     """Find a new reference-derived case without disclosing reserved hidden tests."""
     try:
-        candidate_program = parse(candidate)
-        reference_program = parse(problem.generated_program.program)
+        candidate_program = parse_program(candidate)
+        reference_program = parse_program(problem.generated_program.program)
     except A2BParseException:
         return None
     rng = random.Random(seed)
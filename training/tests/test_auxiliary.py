@@ -27,6 +27,17 @@ class AuxiliaryTaskTests(unittest.TestCase):
         self.assertEqual("step_limit", bounded_trace("a=a", "a", step_limit=2, length_limit=5)["status"])
         self.assertEqual("length_limit", bounded_trace("a=aa", "a", step_limit=10, length_limit=3)["status"])
 
+    def test_compact_trace_rebuilds_the_same_steps(self):
+        source = "(once)=(start)X\nXa=bX\nXb=aX\nX=(return)done"
+        for value, step_limit in (("abba", 20), ("ab" * 8, 5)):
+            full = bounded_trace(source, value, step_limit=step_limit, length_limit=30)
+            compact = bounded_trace(
+                source, value, step_limit=step_limit, length_limit=30, compact=True
+            )
+            self.assertEqual(full["status"], compact["status"])
+            self.assertEqual(full["trace"], list(compact["trace"]))
+            self.assertEqual(full["trace"][-1], compact["trace"][-1])
+
     def test_all_auxiliary_types_are_locally_labelled(self):
         tasks = generate_auxiliary_tasks(self.problems, seed=9)
         for name in (
@@ -1,16 +1,24 @@
+import itertools
+import json
 import random
 import unittest
+from pathlib import Path
 
+from A2B import ENGINES, parse
 from training import GenerationConfig, default_template_catalog
 from training.dataset import (
     InputPoolConfig,
     ProblemBuildConfig,
+    TranspositionTable,
     behavior_signature,
     build_input_pool,
     build_problem,
     evaluate_inputs,
+    execute_batch,
+    execute_with_limits,
     generate_dataset,
 )
+from training.lockstep import available as lockstep_available
 from training.schema import validate_task
 
 
@@ -79,6 +87,254 @@ class InputAndProblemTests(unittest.TestCase):
         self.assertEqual(behavior_signature(first), behavior_signature(second))
 
 
+class ExecutionEngineTests(unittest.TestCase):
+    SOURCES = (
+        "(once)=(end)XXXXXX\naX=(end)a\nbX=(end)b\nX=",
+        "(once)=(start)Y\nYa=bY\nYb=aY\n(end)Y=",
+        "(once)=(end)XXXX\naX=(end)a\nbX=(end)bb\nX=",
+        "cb=bc\nca=ac\nba=ab",
+        "ba=ab\n(once)b=(return)done",
+        "a=aa",
+        "a=a",
+    )
+
+    def test_engines_report_identical_outcomes_and_limits(self):
+        for source in self.SOURCES:
+            program = parse(source)
+            for value in ("", "a", "ab", "abba", "babab", "aaaaaaa"):
+                expected = execute_with_limits(
+                    program, value, max_steps=40, max_length=12
+                )
+                for engine in ENGINES:
+                    with self.subTest(source=source, value=value, engine=engine):
+                        self.assertEqual(
+                            expected,
+                            execute_with_limits(
+                                program,
+                                value,
+                                max_steps=40,
+                                max_length=12,
+                                engine=engine,
+                            ),
+                        )
+
+    def test_generated_python_matches_reference_on_bundled_tasks(self):
+        tasks = Path(__file__).resolve().parents[2] / "tasks"
+        for solution in sorted(tasks.glob("*/solution.a2b")):
+            program = parse(solution.read_text(encoding="utf-8"))
+            with open(solution.parent / "testcase_full.jsonl", encoding="utf-8") as cases:
+                values = [json.loads(line)["input"] for line in cases if line.strip()]
+            for max_steps, max_length in ((10**6, 1000), (25, 12)):
+                with self.subTest(task=solution.parent.name, max_steps=max_steps):
+                    reference = execute_batch(
+                        program, values, max_steps=max_steps, max_length=max_length
+                    )
+                    generated = execute_batch(
+                        program,
+                        values,
+                        max_steps=max_steps,
+                        max_length=max_length,
+                        engine="python",
+                    )
+                    self.assertEqual(reference, generated)
+
+
+class BatchExecutionTests(unittest.TestCase):
+    def test_batch_matches_single_executions_in_input_order(self):
+        program = parse("ba=ab\na=aa\n(once)c=(return)done")
+        inputs = ("", "ba", "bba", "c", "abc", "a" * 7, "b" * 13)
+        batch = execute_batch(program, inputs, max_steps=6, max_length=12)
+        self.assertEqual(len(inputs), len(batch))
+        self.assertIsNone(batch.mismatch)
+        self.assertEqual(
+            tuple(
+                execute_with_limits(program, value, max_steps=6, max_length=12)
+                for value in inputs
+            ),
+            batch.outcomes(),
+        )
+
+    def test_expected_outputs_stop_at_first_mismatch(self):
+        batch = execute_batch(
+            parse("a=b"),
+            ("a", "aa", "ca", "bb"),
+            max_steps=10,
+            max_length=5,
+            expected=("b", "bb", "ca", "bb"),
+        )
+        self.assertEqual(2, batch.mismatch)
+        self.assertEqual(("b", "bb", "cb"), batch.outputs)
+
+    def test_cycle_detection_reports_cycle_length(self):
+        program = parse("ab=ba\nba=ab\nc=d")
+        result = execute_with_limits(
+            program, "cab", max_steps=10**6, max_length=5, detect_cycles=True
+        )
+        self.assertFalse(result.terminating)
+        self.assertEqual("execution_cycle", result.error)
+        self.assertEqual(2, result.cycle_length)
+        self.assertLess(result.steps, 10)
+
+        batch = execute_batch(
+            program,
+            ("c", "cab", "ab"),
+            max_steps=10**6,
+            max_length=5,
+            detect_cycles=True,
+        )
+        self.assertEqual({1: 2, 2: 2}, batch.cycle_lengths)
+        self.assertEqual(result, batch.outcome(1))
+        self.assertEqual("d", batch.outputs[0])
+
+    def test_work_budget_and_deadline_have_their_own_outcomes(self):
+        program = parse("a=b\nb=cc")
+        result = execute_with_limits(
+            program, "aaa", max_steps=100, max_length=10, max_work=45, engine="bulk"
+        )
+        self.assertEqual(("cccccc", 6, None), (result.output, result.steps, result.error))
+
+        result = execute_with_limits(
+            program, "aaa", max_steps=100, max_length=10, max_work=44
+        )
+        self.assertFalse(result.terminating)
+        self.assertEqual(("work_limit", 6), (result.error, result.steps))
+
+        batch = execute_batch(
+            parse("a=a"),
+            ("a", "b"),
+            max_steps=10**9,
+            max_length=5,
+            timeout=0,
+            memo_entries=16,
+        )
+        self.assertEqual("deadline_exceeded", batch.outcome(0).error)
+        self.assertEqual("b", batch.outputs[1])
+
+    def test_transposition_table_keeps_steps_and_limits_exact(self):
+        inputs = tuple(
+            "".join(chars)
+            for length in range(7)
+            for chars in itertools.product("ab", repeat=length)
+        )
+        sources = (
+            "ba=ab\n(once)b=c\nc=(return)done",
+            "(once)=(start)X\nXa=bX\nXb=aX\n(end)X=",
+            "ab=ba\nba=ab",
+            "a=aa",
+        )
+        for source in sources:
+            program = parse(source)
+            for max_steps, detect_cycles in itertools.product(
+                (3, 9, 40), (False, True)
+            ):
+                with self.subTest(
+                    source=source, max_steps=max_steps, detect_cycles=detect_cycles
+                ):
+                    plain = execute_batch(
+                        program,
+                        inputs,
+                        max_steps=max_steps,
+                        max_length=9,
+                        detect_cycles=detect_cycles,
+                    )
+                    memoized = execute_batch(
+                        program,
+                        inputs,
+                        max_steps=max_steps,
+                        max_length=9,
+                        detect_cycles=detect_cycles,
+                        memo_entries=16,
+                    )
+                    self.assertEqual(plain, memoized)
+                    # Too few inputs for a vectorised chunk: the lockstep
+                    # fallback runs memoized on the bulk engine.
+                    fallback = execute_batch(
+                        program,
+                        inputs,
+                        max_steps=max_steps,
+                        max_length=9,
+                        detect_cycles=detect_cycles,
+                        engine="lockstep",
+                        memo_entries=16,
+                    )
+                    self.assertEqual(plain.outcomes(), fallback.outcomes())
+
+    def test_memoized_batches_keep_whole_program_runs(self):
+        inputs = tuple(
+            "".join(chars)
+            for length in range(7)
+            for chars in itertools.product("ab", repeat=length)
+        )
+        source = "(once)=(start)X\nXa=bX\nXb=aX\n(end)X="
+        program = parse(source)
+        memoized = execute_batch(
+            program, inputs, max_steps=40, max_length=9, engine="bulk", memo_entries=16
+        )
+        # The transducer ran every input, so no engine was ever started.
+        self.assertIsNotNone(program.compiled["transducer"])
+        self.assertNotIn("bulk", program.compiled)
+        plain = execute_batch(parse(source), inputs, max_steps=40, max_length=9)
+        self.assertEqual(plain, memoized)
+
+    @unittest.skipUnless(lockstep_available(), "NumPy is not installed")
+    def test_lockstep_batches_match_single_executions(self):
+        inputs = tuple(
+            "".join(chars)
+            for length in range(9)
+            for chars in itertools.product("ab", repeat=length)
+        ) + ("ab" * 20, "b" * 40)
+        sources = ExecutionEngineTests.SOURCES + (
+            "(once)=(start)X\nXa=bX\nXb=aX\n(end)X=(return)done",
+            "(start)a=(end)ba\n(end)b=\nab=(start)c",
+            "=(end)a",
+        )
+        for source in sources:
+            program = parse(source)
+            for max_steps, max_length in ((40, 12), (300, 1000)):
+                with self.subTest(source=source, max_steps=max_steps):
+                    expected = tuple(
+                        execute_with_limits(
+                            program, value, max_steps=max_steps, max_length=max_length
+                        )
+                        for value in inputs
+                    )
+                    batch = execute_batch(
+                        program,
+                        inputs,
+                        max_steps=max_steps,
+                        max_length=max_length,
+                        engine="lockstep",
+                    )
+                    self.assertEqual(expected, batch.outcomes())
+
+    def test_transposition_table_is_a_bounded_lru(self):
+        table = TranspositionTable(2)
+        table.put(("a", 0), (0, "a", 0))
+        table.put(("b", 0), (0, "b", 0))
+        self.assertIsNotNone(table.get(("a", 0)))
+        table.put(("c", 0b1), (0, "c", 0))
+        self.assertEqual(2, len(table))
+        self.assertIsNone(table.get(("b", 0)))
+        self.assertIsNone(table.get(("c", 0)))
+        self.assertIsNotNone(table.get(("c", 0b1)))
+        self.assertEqual((2, 2), (table.hits, table.misses))
+
+    def test_process_pool_preserves_order_and_results(self):
+        program = parse("ab=ba\nb=(end)c")
+        inputs = tuple(
+            "".join(chars)
+            for length in range(6)
+            for chars in itertools.product("abc", repeat=length)
+        )
+        sequential = execute_batch(program, inputs, max_steps=50, max_length=8)
+        for pool in ("process", "thread"):
+            with self.subTest(pool=pool):
+                pooled = execute_batch(
+                    program, inputs, max_steps=50, max_length=8, workers=2, pool=pool
+                )
+                self.assertEqual(sequential, pooled)
+
+
 class DatasetGenerationTests(unittest.TestCase):
     def test_seeded_dataset_is_reproducible_and_deduplicated(self):
         kwargs = {
@@ -1,6 +1,9 @@
+import itertools
 import random
 import unittest
 
+from A2B import parse, transducer
+from training.dataset import execute_batch
 from training.generation import GenerationConfig
 from training.ir import (
     IROperation,
@@ -116,6 +119,51 @@ class IRCompilerTests(unittest.TestCase):
         self.assertEqual(3, len(generated.parameters["marker_allocation"]))
         self.assertIn("marker_isolation", generated.concepts)
 
+    def test_marker_programs_run_as_exact_transducers(self):
+        alphabet = ("a", "b", "c")
+        fst = {
+            "states": ["q0", "q1"],
+            "start_state": "q0",
+            "transitions": {
+                "q0\0a": "q1", "q0\0b": "q0", "q0\0c": "q1",
+                "q1\0a": "q0", "q1\0b": "q1", "q1\0c": "q0",
+            },
+            "accepting_states": ["q1"],
+            "outputs": {"q0\0a": "bb", "q1\0b": "", "q1\0c": "a"},
+        }
+        irs = (
+            TaskIR((IROperation("finite_state_transduction", dict(fst, mode="fst")),), alphabet),
+            TaskIR((IROperation("finite_state_transduction", dict(fst, mode="dfa")),), alphabet),
+            TaskIR(
+                (
+                    IROperation("map", {"mapping": {"a": "b", "b": "cc", "c": "a"}}),
+                    IROperation("delete", {"symbols": ["a"]}),
+                ),
+                alphabet,
+            ),
+        )
+        inputs = [
+            "".join(chars)
+            for length in range(6)
+            for chars in itertools.product(alphabet, repeat=length)
+        ]
+        for ir in irs:
+            source, _, _ = compile_ir(ir, random.Random(3), max_input_length=5)
+            program = parse(source)
+            self.assertIsNotNone(transducer(program), source)
+            for max_steps, max_length in ((10000, 20), (7, 20), (10000, 8)):
+                with self.subTest(source=source, max_steps=max_steps, max_length=max_length):
+                    self.assertEqual(
+                        execute_batch(program, inputs, max_steps=max_steps, max_length=max_length),
+                        execute_batch(
+                            program,
+                            inputs,
+                            max_steps=max_steps,
+                            max_length=max_length,
+                            engine="bulk",
+                        ),
+                    )
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,51 @@
+import threading
+import unittest
+
+from A2B import A2BParseException, execute
+from training.programs import ParseCache
+
+
+class ParseCacheTests(unittest.TestCase):
+    def test_same_source_shares_one_program(self):
+        cache = ParseCache(4)
+        program = cache.parse("a=b\nb=c")
+        self.assertIs(program, cache.parse("a=b\nb=c"))
+        self.assertEqual("cc", execute(program, "ab"))
+        self.assertEqual(
+            {"entries": 1, "hits": 1, "misses": 1}, cache.counters()
+        )
+
+    def test_cache_is_a_bounded_lru_and_does_not_keep_errors(self):
+        cache = ParseCache(2)
+        first = cache.parse("a=b")
+        cache.parse("b=c")
+        cache.parse("a=b")
+        cache.parse("c=d")
+        self.assertEqual(2, len(cache))
+        self.assertIs(first, cache.parse("a=b"))
+        cache.parse("b=c")
+        self.assertEqual((2, 4), (cache.hits, cache.misses))
+        for _ in range(2):
+            with self.assertRaises(A2BParseException):
+                cache.parse("a=b=c")
+        self.assertEqual((2, 6), (cache.hits, cache.misses))
+        self.assertEqual(2, len(cache))
+
+    def test_concurrent_lookups_agree_on_one_program(self):
+        cache = ParseCache()
+        programs = []
+
+        def lookup():
+            programs.append(cache.parse("(once)=(start)X\nXa=bX\nX="))
+
+        threads = [threading.Thread(target=lookup) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(1, len({id(program) for program in programs}))
+        self.assertEqual(8, cache.hits + cache.misses)
+
+
+if __name__ == "__main__":
+    unittest.main()